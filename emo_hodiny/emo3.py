@@ -8,6 +8,8 @@ import networkx as nx
 from matplotlib.patches import Rectangle
 import matplotlib.colors as mcolors
 
+from gp_engine import FORWARD, LEFT, RIGHT, IF_FOOD, compile_tree
+
 # Define the Santa Fe trail map (1 = food, 0 = empty)
 def create_santa_fe_trail():
     trail = np.zeros((32, 32), dtype=int)
@@ -104,6 +106,60 @@ class AntSimulator:
         
         return self.eaten
 
+    def run_program(self, code):
+        """
+        Same as run(gp.compile(individual, pset)) for code from
+        gp_engine.compile_tree(individual), with the ant state in local variables.
+        """
+        self.__init__()
+        height, width = self.trail.shape
+        food = self.trail.ravel().tolist()
+        ahead = [self.AHEAD[direction] for direction in range(4)]
+        (x, y), direction = self.position, self.direction
+        moves, eaten, max_moves = self.moves, self.eaten, self.max_moves
+        eaten_positions, history = self.eaten_positions, self.positions_history
+        end = len(code)
+
+        while moves < max_moves and eaten < TOTAL_FOOD:
+            pc = 0
+            # once the moves are used up the rest of the routine can't change anything
+            while pc < end and moves < max_moves:
+                op = code[pc]
+                if op == FORWARD:
+                    moves += 1
+                    dx, dy = ahead[direction]
+                    x = (x + dx) % width
+                    y = (y + dy) % height
+                    history.append((x, y))
+                    if food[y * width + x] == 1:
+                        food[y * width + x] = 0
+                        eaten += 1
+                        eaten_positions.append((x, y))
+                    pc += 1
+                elif op == LEFT:
+                    moves += 1
+                    direction = (direction - 1) % 4
+                    history.append((x, y))
+                    pc += 1
+                elif op == RIGHT:
+                    moves += 1
+                    direction = (direction + 1) % 4
+                    history.append((x, y))
+                    pc += 1
+                elif op == IF_FOOD:
+                    dx, dy = ahead[direction]
+                    if food[(y + dy) % height * width + (x + dx) % width] == 1:
+                        pc += 2
+                    else:
+                        pc = code[pc + 1]
+                else:
+                    pc = code[pc + 1]
+
+        self.trail = np.array(food, dtype=self.trail.dtype).reshape(height, width)
+        self.position, self.direction = (x, y), direction
+        self.moves, self.eaten = moves, eaten
+        return eaten
+
 # Function set - these functions need to be defined correctly for DEAP
 def if_food_ahead(out1, out2):
     def _if_food_ahead(ant):
@@ -160,11 +216,10 @@ def setup_deap():
     toolbox.register("individual", tools.initIterate, creator.Individual, toolbox.expr)
     toolbox.register("population", tools.initRepeat, list, toolbox.individual)
     
-    # Evaluation function
+    # Evaluation function, the tree runs as bytecode (see gp_engine.py)
     def evaluate(individual):
-        routine = gp.compile(individual, pset)
         ant = AntSimulator()
-        return ant.run(routine),
+        return ant.run_program(compile_tree(individual)),
     
     toolbox.register("evaluate", evaluate)
     toolbox.register("select", tools.selTournament, tournsize=7)
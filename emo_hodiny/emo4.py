@@ -1,16 +1,16 @@
 import numpy as np
-import pygame
 import random
 from deap import base, creator, tools, algorithms, gp
 import operator
 import time
 import argparse
-import networkx as nx
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_agg import FigureCanvasAgg
-from matplotlib.patches import Circle, Rectangle
 import math
 
+from gp_engine import FORWARD, LEFT, RIGHT, IF_FOOD, compile_tree
+
+# pygame and matplotlib are only imported by the functions that draw, so the
+# simulator can be imported (and evolved headless) without a display
+
 # Original Santa Fe trail
 SANTA_FE_TRAIL = [
     (0, 1), (0, 2), (0, 3), (1, 3), (2, 3), (3, 3), (4, 3), (5, 3),
@@ -103,6 +103,7 @@ class AntSimulator:
             self.trail_grid[x, y] = True
         self.visited = set()
         self.movement_history = [(0, 0)]  # Track all positions the ant visits
+        self.last_eaten_moves = 0
     
     def turn_left(self):
         self.direction = (self.direction - 1) % 4
@@ -148,6 +149,71 @@ class AntSimulator:
             
         return self.trail_grid[ahead_x, ahead_y]
 
+    def run_program(self, code, max_moves=600):
+        """
+        Run code from gp_engine.compile_tree(individual) again and again until
+        max_moves, like calling the gp.compile()d routine in a loop, with the
+        ant state in local variables. last_eaten_moves is the move count at the
+        end of the last pass through the routine that found food.
+        """
+        food = self.trail_grid.ravel().tolist()
+        visited = {x * 32 + y for x, y in self.visited}
+        history = self.movement_history
+        x, y, direction = self.x, self.y, self.direction
+        moves, eaten = self.moves, self.eaten
+        last_eaten_moves = 0
+        end = len(code)
+
+        while moves < max_moves:
+            prev_eaten = eaten
+            pc = 0
+            while pc < end:
+                op = code[pc]
+                if op == FORWARD:
+                    if direction == 0:  # east
+                        x = (x + 1) % 32
+                    elif direction == 1:  # south
+                        y = (y + 1) % 32
+                    elif direction == 2:  # west
+                        x = (x - 1) % 32
+                    else:  # north
+                        y = (y - 1) % 32
+                    moves += 1
+                    history.append((x, y))
+                    cell = x * 32 + y
+                    if food[cell] and cell not in visited:
+                        eaten += 1
+                        visited.add(cell)
+                    pc += 1
+                elif op == LEFT:
+                    direction = (direction - 1) % 4
+                    moves += 1
+                    pc += 1
+                elif op == RIGHT:
+                    direction = (direction + 1) % 4
+                    moves += 1
+                    pc += 1
+                elif op == IF_FOOD:
+                    if direction == 0:
+                        cell = (x + 1) % 32 * 32 + y
+                    elif direction == 1:
+                        cell = x * 32 + (y + 1) % 32
+                    elif direction == 2:
+                        cell = (x - 1) % 32 * 32 + y
+                    else:
+                        cell = x * 32 + (y - 1) % 32
+                    pc = pc + 2 if food[cell] else code[pc + 1]
+                else:
+                    pc = code[pc + 1]
+            if eaten > prev_eaten:
+                last_eaten_moves = moves
+
+        self.x, self.y, self.direction = x, y, direction
+        self.moves, self.eaten = moves, eaten
+        self.visited = {(cell // 32, cell % 32) for cell in visited}
+        self.last_eaten_moves = last_eaten_moves
+        return eaten
+
 def if_food_ahead(out1, out2):
     def _if_food_ahead():
         if ant.sense_food():
@@ -179,11 +245,10 @@ def turn_right():
     ant.turn_right()
 
 # Pygame visualization setup
-pygame.init()
 CELL_SIZE = 20
 WINDOW_SIZE = (32 * CELL_SIZE + 200, 32 * CELL_SIZE)  # Added extra space for info panel
-screen = pygame.display.set_mode(WINDOW_SIZE)
-pygame.display.set_caption("Santa Fe Artificial Ant")
+screen = None
+font = None
 
 # Colors
 BLACK = (0, 0, 0)
@@ -196,11 +261,26 @@ LIGHT_GRAY = (200, 200, 200)
 ORANGE = (255, 165, 0)
 PURPLE = (128, 0, 128)
 
-# Initialize font
-pygame.font.init()
-font = pygame.font.SysFont('Arial', 16)
+def init_display():
+    global screen
+    import pygame
+
+    pygame.init()
+    screen = pygame.display.set_mode(WINDOW_SIZE)
+    pygame.display.set_caption("Santa Fe Artificial Ant")
+
+def get_font():
+    # system font lookup is slow, so it waits for the first text
+    global font
+    if font is None:
+        import pygame
+        pygame.font.init()
+        font = pygame.font.SysFont('Arial', 16)
+    return font
 
 def draw_grid():
+    import pygame
+
     screen.fill(WHITE)
     
     # Draw trail and visited cells
@@ -271,13 +351,16 @@ def draw_grid():
     ]
     
     for i, text in enumerate(info_texts):
-        text_surface = font.render(text, True, WHITE)
+        text_surface = get_font().render(text, True, WHITE)
         screen.blit(text_surface, (32 * CELL_SIZE + 10, 20 + i * 25))
     
     pygame.display.flip()
 
 def plot_tree_custom(expr, output_file='tree.png'):
     """Plot the tree expression using a custom algorithm without NetworkX"""
+    import matplotlib.pyplot as plt
+    from matplotlib.patches import Circle, Rectangle
+
     nodes, edges, labels = gp.graph(expr)
     
     # Create figure and axis - much larger figure for dense trees
@@ -416,6 +499,8 @@ def plot_tree_custom(expr, output_file='tree.png'):
 
 def show_tree_on_pygame(tree_image_path):
     """Display the tree image on a separate Pygame window with pan and zoom"""
+    import pygame
+
     # Load the tree image
     tree_image = pygame.image.load(tree_image_path)
     original_image = tree_image.copy()  # Keep a copy of the original image
@@ -571,24 +656,12 @@ if __name__ == "__main__":
 
     # Evaluation function with improved heuristics
     def evalArtificialAnt(individual):
-        routine = gp.compile(individual, pset)
+        # the routine runs as bytecode (see gp_engine.py) until the ant used its 600 moves
         ant.reset()
+        ant.run_program(compile_tree(individual))
         
-        # Keep track of time spent without eating
-        last_eaten = 0
-        idle_penalty = 0
-        
-        while ant.moves < 600:
-            prev_eaten = ant.eaten
-            routine()
-            
-            # If we ate something, reset the idle counter
-            if ant.eaten > prev_eaten:
-                last_eaten = ant.moves
-                idle_penalty = 0
-            else:
-                # Penalize too much time without eating
-                idle_penalty = max(0, (ant.moves - last_eaten) / 100)
+        # Penalize too much time without eating, since the last pass through the routine that found food
+        idle_penalty = (ant.moves - ant.last_eaten_moves) / 100
         
         # Base fitness is the number of food eaten
         fitness = ant.eaten
@@ -714,6 +787,9 @@ if __name__ == "__main__":
     print(f"Best individual structure: {best_tree[:50]}..." if len(best_tree) > 50 else best_tree)
     
     # Visualize best solution
+    import pygame
+
+    init_display()
     best_routine = gp.compile(hof[0], pset)
     ant.reset()
     running = True
@@ -760,7 +836,7 @@ if __name__ == "__main__":
         
         # If simulation completed
         if ant.moves >= 600:
-            text = font.render("Simulation completed! Press ESC to quit or T to view the decision tree", True, WHITE)
+            text = get_font().render("Simulation completed! Press ESC to quit or T to view the decision tree", True, WHITE)
             text_rect = text.get_rect(center=(32 * CELL_SIZE // 2, 32 * CELL_SIZE - 30))
             screen.blit(text, text_rect)
             pygame.display.flip()
@@ -0,0 +1,61 @@
+"""
+Compiles Santa Fe ant GP trees (if_food_ahead, prog2, prog3 and the three
+moves) into flat bytecode, so an ant can run a program in one interpreter
+loop instead of a Python call per node.
+
+A DEAP PrimitiveTree is already a prefix list, which is the order the
+nodes run in. progN nodes only run their children one after the other, so
+they compile to nothing. The moves are one opcode each and if_food_ahead
+becomes a conditional jump over its first branch plus a jump over the second
+one at the end of the first:
+
+    IF_FOOD <else>  <first branch>  JUMP <end>  <else: second branch>  <end:>
+
+The interpreters live with each ant simulator (AntSimulator.run_program()),
+as the two scripts' ants don't move and eat quite the same way.
+"""
+
+FORWARD, LEFT, RIGHT, IF_FOOD, JUMP = range(5)
+SEQUENCE = -1
+
+# node names of both scripts' primitive sets
+OPCODES = {
+    'if_food_ahead': IF_FOOD,
+    'prog2': SEQUENCE,
+    'prog3': SEQUENCE,
+    'forward': FORWARD,
+    'move_forward': FORWARD,
+    'left': LEFT,
+    'turn_left': LEFT,
+    'right': RIGHT,
+    'turn_right': RIGHT,
+}
+
+
+def compile_tree(tree, opcodes=OPCODES):
+    """Bytecode (a list of ints) of a gp.PrimitiveTree."""
+    code = []
+
+    def emit(index):
+        # compiles the subtree starting at index, returns the index after it
+        node = tree[index]
+        op = opcodes[node.name]
+        index += 1
+        if op == IF_FOOD:
+            code.extend((IF_FOOD, 0))
+            else_slot = len(code) - 1
+            index = emit(index)
+            code.extend((JUMP, 0))
+            end_slot = len(code) - 1
+            code[else_slot] = len(code)
+            index = emit(index)
+            code[end_slot] = len(code)
+        elif op == SEQUENCE:
+            for _ in range(node.arity):
+                index = emit(index)
+        else:
+            code.append(op)
+        return index
+
+    emit(0)
+    return code
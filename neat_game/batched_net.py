@@ -0,0 +1,277 @@
+import numpy as np
+import neat
+
+TANH = 0
+RELU = 1
+SIGMOID = 2
+IDENTITY = 3
+
+ACTIVATION_CODES = {
+    'tanh': TANH,
+    'relu': RELU,
+    'sigmoid': SIGMOID,
+    'identity': IDENTITY,
+}
+
+
+def apply_activation(codes, z):
+    # same clamping and scaling as neat.activations
+    tanh = np.tanh(np.clip(2.5 * z, -60.0, 60.0))
+    sigmoid = 1.0 / (1.0 + np.exp(-np.clip(5.0 * z, -60.0, 60.0)))
+    relu = np.where(z > 0.0, z, 0.0)
+    out = np.where(codes == TANH, tanh, z)
+    out = np.where(codes == RELU, relu, out)
+    return np.where(codes == SIGMOID, sigmoid, out)
+
+
+class BatchedFeedForwardNetworks:
+    """
+    All feed forward networks of a population compiled into padded NumPy arrays.
+
+    Every network gets a row in a shared value table. Columns are the inputs, a
+    constant zero column, one column per evaluated node and a scratch column that
+    padding writes into. Nodes are grouped by depth, so each layer is a handful of
+    gathers and multiply-adds over all networks at once. Links are accumulated in
+    the same order as neat's FeedForwardNetwork, so the results match it up to
+    rounding in tanh/exp.
+    """
+    def __init__(self, num_inputs, num_outputs, num_columns, layers, output_columns):
+        self.num_inputs = num_inputs
+        self.num_outputs = num_outputs
+        self.num_columns = num_columns
+        self.layers = layers
+        self.output_columns = output_columns
+        self.size = len(output_columns)
+
+    @staticmethod
+    def create(genomes, config):
+        """Compile a list of genomes into one batched network."""
+        genome_config = config.genome_config
+        input_keys = genome_config.input_keys
+        output_keys = genome_config.output_keys
+        num_inputs = len(input_keys)
+        zero_column = num_inputs
+
+        compiled = []
+        for genome in genomes:
+            connections = [cg.key for cg in genome.connections.values() if cg.enabled]
+            layers = neat.graphs.feed_forward_layers(input_keys, output_keys, connections)
+
+            columns = {key: i for i, key in enumerate(input_keys)}
+            depth = {key: 0 for key in input_keys}
+            nodes = []
+            for layer in layers:
+                for node in layer:
+                    links = [(inode, genome.connections[(inode, onode)].weight)
+                             for inode, onode in connections if onode == node]
+                    ng = genome.nodes[node]
+                    if ng.aggregation != 'sum':
+                        raise ValueError(f"Unsupported aggregation for batched networks: {ng.aggregation}")
+                    if ng.activation not in ACTIVATION_CODES:
+                        raise ValueError(f"Unsupported activation for batched networks: {ng.activation}")
+                    columns[node] = zero_column + 1 + len(nodes)
+                    depth[node] = 1 + max(depth[inode] for inode, _ in links)
+                    nodes.append((node, depth[node], ACTIVATION_CODES[ng.activation], ng.bias, ng.response, links))
+            compiled.append((columns, nodes))
+
+        count = len(compiled)
+        max_nodes = max((len(nodes) for _, nodes in compiled), default=0)
+        scratch_column = zero_column + 1 + max_nodes
+        num_columns = scratch_column + 1
+        num_layers = max((node[1] for _, nodes in compiled for node in nodes), default=0)
+
+        layers = []
+        for level in range(1, num_layers + 1):
+            per_net = [[node for node in nodes if node[1] == level] for _, nodes in compiled]
+            width = max(len(layer_nodes) for layer_nodes in per_net)
+            fan_in = max((len(node[5]) for layer_nodes in per_net for node in layer_nodes), default=0)
+
+            sources = np.full((count, width, fan_in), zero_column, dtype=np.intp)
+            weights = np.zeros((count, width, fan_in))
+            bias = np.zeros((count, width))
+            response = np.zeros((count, width))
+            codes = np.full((count, width), IDENTITY, dtype=np.int8)
+            targets = np.full((count, width), scratch_column, dtype=np.intp)
+
+            for n, layer_nodes in enumerate(per_net):
+                columns = compiled[n][0]
+                for j, (node, _, code, node_bias, node_response, links) in enumerate(layer_nodes):
+                    for k, (inode, weight) in enumerate(links):
+                        sources[n, j, k] = columns[inode]
+                        weights[n, j, k] = weight
+                    bias[n, j] = node_bias
+                    response[n, j] = node_response
+                    codes[n, j] = code
+                    targets[n, j] = columns[node]
+            layers.append((sources, weights, bias, response, codes, targets))
+
+        # outputs that nothing feeds into stay at 0.0, just like in FeedForwardNetwork
+        output_columns = np.array([[columns.get(key, zero_column) for key in output_keys]
+                                   for columns, _ in compiled], dtype=np.intp).reshape(count, len(output_keys))
+
+        return BatchedFeedForwardNetworks(num_inputs, len(output_keys), num_columns, layers, output_columns)
+
+    def activate(self, inputs, rows=None):
+        """
+        Evaluate several networks at once.
+
+        inputs is an (n, num_inputs) array, rows the indices of the networks it
+        belongs to (all networks when None). Returns an (n, num_outputs) array.
+        """
+        inputs = np.asarray(inputs, dtype=np.float64)
+        if rows is None:
+            rows = np.arange(self.size)
+        if inputs.shape != (len(rows), self.num_inputs):
+            raise RuntimeError(f"Expected inputs of shape {(len(rows), self.num_inputs)}, got {inputs.shape}")
+
+        values = np.zeros((len(rows), self.num_columns))
+        values[:, :self.num_inputs] = inputs
+        r = np.arange(len(rows))[:, None]
+
+        for sources, weights, bias, response, codes, targets in self.layers:
+            sources = sources[rows]
+            weights = weights[rows]
+            s = np.zeros(sources.shape[:2])
+            for k in range(sources.shape[2]):
+                s += values[r, sources[:, :, k]] * weights[:, :, k]
+            values[r, targets[rows]] = apply_activation(codes[rows], bias[rows] + response[rows] * s)
+
+        return values[r, self.output_columns[rows]]
+
+    def reset(self, rows=None):
+        # feed forward networks keep no state between activations
+        pass
+
+
+class BatchedRecurrentNetworks:
+    """
+    All recurrent networks of a population with their state in one array.
+
+    Like neat's RecurrentNetwork every node reads the values its inputs had
+    after the previous activation, so an activation is a single gather and
+    multiply-add pass over all nodes of all networks instead of one pass per
+    depth. values holds the state of every network in one preallocated
+    (networks, columns) array with the same column layout as the feed forward
+    version: inputs, a constant zero column, the nodes and a scratch column.
+    """
+    def __init__(self, num_inputs, num_outputs, num_columns, layer, output_columns):
+        self.num_inputs = num_inputs
+        self.num_outputs = num_outputs
+        self.num_columns = num_columns
+        self.layer = layer
+        self.output_columns = output_columns
+        self.size = len(output_columns)
+        self.values = np.zeros((self.size, num_columns))
+
+    @staticmethod
+    def create(genomes, config):
+        """Compile a list of genomes into one batched recurrent network."""
+        genome_config = config.genome_config
+        input_keys = genome_config.input_keys
+        output_keys = genome_config.output_keys
+        num_inputs = len(input_keys)
+        zero_column = num_inputs
+
+        compiled = []
+        for genome in genomes:
+            # same node and link selection (and link order) as RecurrentNetwork.create
+            required = neat.graphs.required_for_output(input_keys, output_keys, genome.connections)
+            node_inputs = {}
+            for cg in genome.connections.values():
+                if not cg.enabled:
+                    continue
+                i, o = cg.key
+                if o not in required and i not in required:
+                    continue
+                node_inputs.setdefault(o, []).append((i, cg.weight))
+
+            columns = {key: i for i, key in enumerate(input_keys)}
+            for node, links in node_inputs.items():
+                for key in [node] + [inode for inode, _ in links]:
+                    if key not in columns:
+                        columns[key] = zero_column + len(columns) - num_inputs + 1
+
+            nodes = []
+            for node, links in node_inputs.items():
+                ng = genome.nodes[node]
+                if ng.aggregation != 'sum':
+                    raise ValueError(f"Unsupported aggregation for batched networks: {ng.aggregation}")
+                if ng.activation not in ACTIVATION_CODES:
+                    raise ValueError(f"Unsupported activation for batched networks: {ng.activation}")
+                nodes.append((node, ACTIVATION_CODES[ng.activation], ng.bias, ng.response, links))
+            compiled.append((columns, nodes))
+
+        count = len(compiled)
+        max_columns = max((len(columns) - num_inputs for columns, _ in compiled), default=0)
+        scratch_column = zero_column + 1 + max_columns
+        num_columns = scratch_column + 1
+        width = max((len(nodes) for _, nodes in compiled), default=0)
+        fan_in = max((len(node[4]) for _, nodes in compiled for node in nodes), default=0)
+
+        sources = np.full((count, width, fan_in), zero_column, dtype=np.intp)
+        weights = np.zeros((count, width, fan_in))
+        bias = np.zeros((count, width))
+        response = np.zeros((count, width))
+        codes = np.full((count, width), IDENTITY, dtype=np.int8)
+        targets = np.full((count, width), scratch_column, dtype=np.intp)
+        for n, (columns, nodes) in enumerate(compiled):
+            for j, (node, code, node_bias, node_response, links) in enumerate(nodes):
+                for k, (inode, weight) in enumerate(links):
+                    sources[n, j, k] = columns[inode]
+                    weights[n, j, k] = weight
+                bias[n, j] = node_bias
+                response[n, j] = node_response
+                codes[n, j] = code
+                targets[n, j] = columns[node]
+
+        # outputs without incoming links are never evaluated and stay at 0.0
+        output_columns = np.array([[columns.get(key, zero_column) for key in output_keys]
+                                   for columns, _ in compiled], dtype=np.intp).reshape(count, len(output_keys))
+
+        layer = (sources, weights, bias, response, codes, targets)
+        return BatchedRecurrentNetworks(num_inputs, len(output_keys), num_columns, layer, output_columns)
+
+    def reset(self, rows=None):
+        """Zero the state of the given networks (all when None)."""
+        if rows is None:
+            self.values[:] = 0.0
+        else:
+            self.values[rows] = 0.0
+
+    def activate(self, inputs, rows=None):
+        """
+        Advance several networks by one step.
+
+        inputs is an (n, num_inputs) array, rows the indices of the networks it
+        belongs to (all networks when None). Returns an (n, num_outputs) array.
+        """
+        inputs = np.asarray(inputs, dtype=np.float64)
+        if rows is None:
+            rows = np.arange(self.size)
+        if inputs.shape != (len(rows), self.num_inputs):
+            raise RuntimeError(f"Expected inputs of shape {(len(rows), self.num_inputs)}, got {inputs.shape}")
+
+        values = self.values[rows]
+        values[:, :self.num_inputs] = inputs
+        r = np.arange(len(rows))[:, None]
+
+        sources, weights, bias, response, codes, targets = self.layer
+        sources = sources[rows]
+        weights = weights[rows]
+        # every node is computed from the previous values before any of them is overwritten
+        s = np.zeros(sources.shape[:2])
+        for k in range(sources.shape[2]):
+            s += values[r, sources[:, :, k]] * weights[:, :, k]
+        values[r, targets[rows]] = apply_activation(codes[rows], bias[rows] + response[rows] * s)
+        # the scratch column only ever collects padding
+        values[:, -1] = 0.0
+
+        self.values[rows] = values
+        return values[r, self.output_columns[rows]]
+
+
+def create_networks(genomes, config):
+    """Batched networks for the genomes, recurrent unless the genome config says feed_forward."""
+    if config.genome_config.feed_forward:
+        return BatchedFeedForwardNetworks.create(genomes, config)
+    return BatchedRecurrentNetworks.create(genomes, config)
@@ -0,0 +1,260 @@
+"""
+Benchmarks of the walker pipeline, runnable without a display.
+
+Every benchmark uses fixed seeds, so two runs on the same machine measure the
+same work. Results are appended as one JSON line per run to a history file and
+compared with the previous run of the same benchmarks with the same settings
+on the same machine.
+
+    python benchmark.py                          # everything
+    python benchmark.py physics activation --quick
+    python benchmark.py generation --pops 50,200
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import neat
+import numpy as np
+import pymunk
+
+import game_neat
+from batched_net import BatchedFeedForwardNetworks, BatchedRecurrentNetworks
+
+LOCAL_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_HISTORY = os.path.join(LOCAL_DIR, 'benchmarks', 'history.jsonl')
+SPAWN_POS = (150, game_neat.SCREEN_HEIGHT - 200)
+
+
+def measure(func, repeat=5, number=1):
+    """Median wall time of one func() call over repeat rounds of number calls."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number)
+    return float(np.median(times))
+
+
+def load_config(pop_size):
+    config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                         neat.DefaultSpeciesSet, neat.DefaultStagnation,
+                         os.path.join(LOCAL_DIR, 'config-feedforward.txt'))
+    config.pop_size = pop_size
+    return config
+
+
+def make_genomes(pop_size, seed, mutations=0):
+    """A seeded initial population, every genome mutated `mutations` times to grow its topology."""
+    random.seed(seed)
+    config = load_config(pop_size)
+    population = neat.Population(config)
+    genomes = sorted(population.population.items())
+    for _, genome in genomes:
+        for _ in range(mutations):
+            genome.mutate(config.genome_config)
+    return genomes, config
+
+
+def make_walkers(count, isolated):
+    space = None if isolated else game_neat.create_world()
+    return [game_neat.Humanoid(game_neat.create_world() if isolated else space, SPAWN_POS, i)
+            for i in range(count)], space
+
+
+def bench_physics(args):
+    """Seconds per physics step of count walkers, all in one space or one space each."""
+    results = {}
+    for count in (1, 10, 50) if args.quick else (1, 10, 50, 200):
+        for isolated in (False, True):
+            walkers, space = make_walkers(count, isolated)
+            spaces = [walker.space for walker in walkers] if isolated else [space]
+            # let them fall onto the ground first so the contacts are part of the work
+            for _ in range(30):
+                for walker_space in spaces:
+                    walker_space.step(game_neat.PHYSICS_STEPS)
+
+            def step():
+                for walker_space in spaces:
+                    walker_space.step(game_neat.PHYSICS_STEPS)
+            mode = 'isolated' if isolated else 'shared'
+            results[f'{mode}_{count}'] = measure(step, repeat=5, number=20 if args.quick else 60)
+    return results
+
+
+def bench_activation(args):
+    """Seconds to activate the whole population once, one neat network at a time or batched, feed forward and recurrent."""
+    results = {}
+    for pop_size in (50, 200) if args.quick else (50, 200, 1000):
+        for mutations in (0, 20):
+            genomes, config = make_genomes(pop_size, seed=1, mutations=mutations)
+            networks = [neat.nn.FeedForwardNetwork.create(genome, config) for _, genome in genomes]
+            batched = BatchedFeedForwardNetworks.create([genome for _, genome in genomes], config)
+            inputs = np.random.default_rng(1).uniform(-1, 1, size=(pop_size, config.genome_config.num_inputs))
+            input_lists = inputs.tolist()
+
+            def per_genome():
+                for network, network_inputs in zip(networks, input_lists):
+                    network.activate(network_inputs)
+            name = f'pop{pop_size}_mut{mutations}'
+            results[f'neat_{name}'] = measure(per_genome, number=10)
+            results[f'batched_{name}'] = measure(lambda: batched.activate(inputs), number=10)
+
+            config.genome_config.feed_forward = False
+            recurrent = [neat.nn.RecurrentNetwork.create(genome, config) for _, genome in genomes]
+            batched_recurrent = BatchedRecurrentNetworks.create([genome for _, genome in genomes], config)
+
+            def per_genome_recurrent():
+                for network, network_inputs in zip(recurrent, input_lists):
+                    network.activate(network_inputs)
+            results[f'neat_recurrent_{name}'] = measure(per_genome_recurrent, number=10)
+            results[f'batched_recurrent_{name}'] = measure(lambda: batched_recurrent.activate(inputs), number=10)
+    return results
+
+
+def bench_state(args):
+    """Seconds per walker for reading the bodies, the sensor inputs and the fitness update."""
+    count = 50 if args.quick else 200
+    walkers, _ = make_walkers(count, isolated=True)
+    for walker in walkers:
+        for _ in range(30):
+            walker.space.step(game_neat.PHYSICS_STEPS)
+    state = game_neat.PopulationState(walkers)
+    rows = np.arange(count)
+    state.update(rows)
+    outputs = np.random.default_rng(1).uniform(-1, 1, size=(count, 6))
+    return {
+        'update_per_walker': measure(lambda: state.update(rows), number=50) / count,
+        'sensor_inputs_per_walker': measure(lambda: state.sensor_inputs(rows), number=50) / count,
+        'check_fall_per_walker': measure(lambda: state.check_fall(rows, 0.0), number=50) / count,
+        'calculate_fitness_per_walker': measure(lambda: state.calculate_fitness(rows, outputs), number=50) / count,
+    }
+
+
+def bench_generation(args):
+    """Seconds to evaluate one generation (a seeded initial population) and its walker steps per second."""
+    game_neat.HEADLESS = True
+    results = {}
+    for pop_size in (int(pop) for pop in args.pops.split(',')):
+        genomes, config = make_genomes(pop_size, seed=1)
+        # walkers pooled by earlier benchmarks or population sizes would make the setup cheaper
+        game_neat.walker_pool = game_neat.WalkerPool()
+        start = time.perf_counter()
+        walker_steps = game_neat.simulate(genomes, config, headless=True, isolated=game_neat.ISOLATED)
+        elapsed = time.perf_counter() - start
+        results[f'pop{pop_size}_seconds'] = elapsed
+        results[f'pop{pop_size}_steps_per_second'] = walker_steps / elapsed
+        results[f'pop{pop_size}_walker_steps'] = walker_steps
+    return results
+
+
+def bench_construction(args):
+    """Seconds to build one walker with its own space, and to reset a pooled one instead."""
+    number = 50 if args.quick else 200
+    walker = game_neat.Humanoid(game_neat.create_world(), SPAWN_POS, 0)
+    return {
+        'build': measure(lambda: game_neat.Humanoid(game_neat.create_world(), SPAWN_POS, 0), number=number),
+        'reset': measure(lambda: walker.reset(SPAWN_POS), number=number),
+    }
+
+
+BENCHMARKS = {
+    'physics': bench_physics,
+    'activation': bench_activation,
+    'state': bench_state,
+    'generation': bench_generation,
+    'construction': bench_construction,
+}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=LOCAL_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run_settings(args):
+    """What a run's results depend on besides the code, only runs with the same settings are compared."""
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'host': platform.node(),
+        'quick': args.quick,
+        'pops': args.pops,
+    }
+
+
+def previous_result(history, name, key, settings):
+    # --pops only changes the generation benchmark
+    compared = [setting for setting in settings if setting != 'pops' or name == 'generation']
+    for entry in reversed(history):
+        if any(entry.get(setting) != settings[setting] for setting in compared):
+            continue
+        value = entry['results'].get(name, {}).get(key)
+        if value is not None:
+            return value
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the NEAT walker pipeline')
+    parser.add_argument('benchmarks', nargs='*', help=f"Benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument('--quick', action='store_true', help='Fewer sizes and repeats')
+    parser.add_argument('--pops', default='50,200,1000', help='Population sizes of the generation benchmark')
+    parser.add_argument('--history', default=DEFAULT_HISTORY, help='JSON lines file the results are appended to')
+    parser.add_argument('--no-save', action='store_true', help="Don't append this run to the history")
+    args = parser.parse_args()
+
+    names = args.benchmarks or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+    history = load_history(args.history)
+    settings = run_settings(args)
+
+    results = {}
+    for name in names:
+        start = time.perf_counter()
+        results[name] = BENCHMARKS[name](args)
+        print(f"{name} ({time.perf_counter() - start:.1f} s)")
+        for key, value in results[name].items():
+            previous = previous_result(history, name, key, settings)
+            change = f"{(value / previous - 1) * 100:+7.1f}%" if previous else ''
+            print(f"  {key:<36} {value:14.6g} {change}")
+
+    entry = {
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'pymunk': pymunk.version,
+        'numpy': np.__version__,
+        **settings,
+        'results': results,
+    }
+    if not args.no_save:
+        directory = os.path.dirname(args.history)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.history, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+        print(f"Appended results to {args.history}")
+
+
+if __name__ == '__main__':
+    main()
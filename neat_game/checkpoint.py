@@ -0,0 +1,95 @@
+import gzip
+import itertools
+import os
+import pickle
+import random
+import threading
+
+import neat
+
+
+class AsyncCheckpointer(neat.reporting.BaseReporter):
+    """
+    Like neat.Checkpointer, but only the pickling happens in the evaluation loop.
+
+    Every generation_interval generations the population, species set, RNG state
+    and (optionally) the fitness cache are pickled into memory, compressing and
+    writing the file is done by a background thread. Files are written to a temp
+    name first, so a run killed mid-write never leaves a broken checkpoint.
+    """
+    def __init__(self, generation_interval=10, filename_prefix='neat-checkpoint-', cache=None, reproduction=None):
+        self.generation_interval = generation_interval
+        self.filename_prefix = filename_prefix
+        self.cache = cache
+        # the population's reproduction, its genome key counter isn't part of what reporters get
+        self.reproduction = reproduction
+        self.current_generation = None
+        self.writer = None
+
+    def __getstate__(self):
+        # the species set keeps a reference to every reporter and gets pickled with
+        # the checkpoint, so leave out the writer thread, the (already saved) cache and the reproduction
+        state = self.__dict__.copy()
+        state['writer'] = None
+        state['cache'] = None
+        state['reproduction'] = None
+        return state
+
+    def start_generation(self, generation):
+        self.current_generation = generation
+
+    def end_generation(self, config, population, species_set):
+        if (self.current_generation + 1) % self.generation_interval == 0:
+            self.save_checkpoint(config, population, species_set, self.current_generation + 1)
+
+    def save_checkpoint(self, config, population, species_set, generation):
+        # population is already the next generation here, so it is saved under that number
+        cache_state = self.cache.get_state() if self.cache is not None else None
+        next_genome_key = None
+        if self.reproduction is not None:
+            # reading the counter advances it, so it is put back where it was
+            next_genome_key = next(self.reproduction.genome_indexer)
+            self.reproduction.genome_indexer = itertools.count(next_genome_key)
+        data = pickle.dumps((generation, config, population, species_set, random.getstate(), cache_state,
+                             next_genome_key), protocol=pickle.HIGHEST_PROTOCOL)
+        filename = '{0}{1}'.format(self.filename_prefix, generation)
+
+        # never more than one write in flight
+        self.wait()
+        self.writer = threading.Thread(target=self._write, args=(filename, data), daemon=True)
+        self.writer.start()
+
+    @staticmethod
+    def _write(filename, data):
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'wb') as f:
+            f.write(gzip.compress(data, compresslevel=5))
+        os.replace(tmp_filename, filename)
+        print("Saved checkpoint to {0}".format(filename))
+
+    def wait(self):
+        if self.writer is not None:
+            self.writer.join()
+            self.writer = None
+
+
+def restore_checkpoint(filename):
+    """
+    Resume from a checkpoint written by AsyncCheckpointer.
+
+    Restores the RNG state and the genome key counter. Returns the
+    neat.Population (reporters have to be added again) and the saved fitness
+    cache state, for FitnessCache.set_state() once the cache exists.
+    """
+    with gzip.open(filename) as f:
+        generation, config, population, species_set, rndstate, cache_state, *rest = pickle.load(f)
+    # checkpoints from before the genome key counter was saved don't have it
+    next_genome_key = rest[0] if rest else None
+    random.setstate(rndstate)
+    restored = neat.Population(config, (population, species_set, generation))
+    if next_genome_key is not None:
+        restored.reproduction.genome_indexer = itertools.count(next_genome_key)
+    return restored, cache_state
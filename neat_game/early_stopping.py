@@ -0,0 +1,184 @@
+import math
+
+import neat
+import numpy as np
+
+
+class StagnationPolicy:
+    """Walker's best x position didn't improve by min_progress pixels in the last window steps."""
+    name = 'stagnation'
+
+    def __init__(self, window=180, min_progress=5.0):
+        self.window = window
+        self.min_progress = min_progress
+
+    def triggered(self, engine, state, rows):
+        return state.max_x[rows] - engine.ago('max_x', self.window, rows) < self.min_progress
+
+
+class VelocityFloorPolicy:
+    """Walker's average forward speed over the last window steps is below min_velocity px/s."""
+    name = 'velocity_floor'
+
+    def __init__(self, window=180, min_velocity=10.0):
+        self.window = window
+        self.min_velocity = min_velocity
+
+    def triggered(self, engine, state, rows):
+        distance = engine.ago('x', 0, rows) - engine.ago('x', self.window, rows)
+        return distance / (self.window * engine.dt) < self.min_velocity
+
+
+class FitnessSlopePolicy:
+    """Walker's fitness grew by less than min_slope per step over the last window steps."""
+    name = 'fitness_slope'
+
+    def __init__(self, window=180, min_slope=0.0):
+        self.window = window
+        self.min_slope = min_slope
+
+    def triggered(self, engine, state, rows):
+        slope = (state.fitness[rows] - engine.ago('fitness', self.window, rows)) / self.window
+        return slope < self.min_slope
+
+
+class FootstepPolicy:
+    """Walker took fewer than min_steps steps (feet touching down in turn) in the last window steps."""
+    name = 'footsteps'
+
+    def __init__(self, window=300, min_steps=1):
+        self.window = window
+        self.min_steps = min_steps
+
+    def triggered(self, engine, state, rows):
+        return state.steps_taken[rows] - engine.ago('steps_taken', self.window, rows) < self.min_steps
+
+
+def default_policies():
+    return [StagnationPolicy(), VelocityFloorPolicy(), FitnessSlopePolicy()]
+
+
+class EarlyStopping:
+    """
+    Stops walkers whose episode can't matter any more.
+
+    A walker is stopped when one of the policies fires for it and even an
+    optimistic projection of its final fitness is still below the k-th best
+    final fitness seen so far in this episode, with k = keep_fraction of the
+    walkers. The fitness is recomputed from the pose every step, so the
+    projection starts from the best fitness of the last window steps and adds
+    the larger of the recent slope and optimistic_slope for every remaining
+    step, optimistic_slope being about the step time bonus plus a slow walk.
+    A walker is never stopped while a pose penalty is transient, so a stopped
+    walker doesn't keep a momentary penalty as its score: the leg spread
+    penalty counts as transient whenever it is active, the torso and head
+    ground penalties while they are more than penalty_tolerance above their
+    lowest value of the window (a walker that sits on the ground keeps them).
+
+    Note that this makes a stopped genome's score depend on the rest of the
+    population. It can be higher or lower than the full episode would give,
+    but only walkers that were out of the running are stopped.
+    """
+    def __init__(self, policies=None, keep_fraction=0.3, dt=1 / 60.0, optimistic_slope=0.05, penalty_tolerance=1.0):
+        self.policies = policies if policies is not None else default_policies()
+        self.keep_fraction = keep_fraction
+        self.dt = dt
+        self.optimistic_slope = optimistic_slope
+        self.penalty_tolerance = penalty_tolerance
+        self.window = max(policy.window for policy in self.policies)
+        self.stats = {policy.name: {'walkers': 0, 'steps_saved': 0} for policy in self.policies}
+
+    def describe(self):
+        """Every setting that decides which walkers get stopped, for the fitness cache salt."""
+        policies = ','.join(f"{policy.name}{sorted(vars(policy).items())}" for policy in self.policies)
+        return (f"keep{self.keep_fraction!r}:slope{self.optimistic_slope!r}:tolerance{self.penalty_tolerance!r}"
+                f":{policies}")
+
+    def __getstate__(self):
+        # the episode history is rebuilt by start(), so it doesn't go into checkpoints
+        # (the species set's reporters reference this) or to worker processes
+        state = self.__dict__.copy()
+        state.pop('history', None)
+        state.pop('finished', None)
+        return state
+
+    def start(self, count, episode_steps):
+        """Reset the per-episode history for count walkers."""
+        self.episode_steps = episode_steps
+        self.k = max(1, math.ceil(self.keep_fraction * count))
+        self.finished = []
+        self.step = 0
+        self.history = {field: np.zeros((self.window + 1, count)) for field in ('max_x', 'x', 'fitness', 'steps_taken', 'ground_penalty')}
+
+    def ago(self, field, steps, rows):
+        return self.history[field][(self.step - steps) % (self.window + 1), rows]
+
+    def check(self, state, rows, alive, step):
+        """
+        Record this step and return a boolean mask over rows of walkers to stop.
+
+        alive tells which rows survived check_fall this step, the fitness of the
+        others is final and counts towards the k-th best.
+        """
+        self.step = step
+        slot = step % (self.window + 1)
+        self.history['max_x'][slot, rows] = state.max_x[rows]
+        self.history['x'][slot, rows] = state.data[rows, 0, 0]  # torso x
+        self.history['fitness'][slot, rows] = state.fitness[rows]
+        self.history['steps_taken'][slot, rows] = state.steps_taken[rows]
+        self.history['ground_penalty'][slot, rows] = state.ground_penalty[rows]
+        self.finished.extend(state.fitness[rows[~alive]])
+
+        stop = np.zeros(len(rows), dtype=bool)
+        if step <= self.window or len(self.finished) < self.k or not alive.any():
+            return stop
+
+        threshold = np.partition(self.finished, -self.k)[-self.k]
+        live_rows = rows[alive]
+        remaining = self.episode_steps - step
+        best_recent = self.history['fitness'][:, live_rows].max(axis=0)
+        slope = (state.fitness[live_rows] - self.ago('fitness', self.window, live_rows)) / self.window
+        projected = best_recent + np.maximum(slope, self.optimistic_slope) * remaining
+        # while a penalty is transient the current fitness says little about the walker: the leg spread
+        # penalty is unbounded and swings by thousands between poses, the ground penalties are transient
+        # while above the lowest they were in the window
+        lowest_ground_penalty = self.history['ground_penalty'][:, live_rows].min(axis=0)
+        transient = ((state.leg_spread_penalty[live_rows] > 0.0) |
+                     (state.ground_penalty[live_rows] > lowest_ground_penalty + self.penalty_tolerance))
+        hopeless = (projected < threshold) & ~transient
+
+        live_stop = np.zeros(len(live_rows), dtype=bool)
+        for policy in self.policies:
+            fired = hopeless & ~live_stop & policy.triggered(self, state, live_rows)
+            count = int(fired.sum())
+            if count:
+                self.stats[policy.name]['walkers'] += count
+                self.stats[policy.name]['steps_saved'] += count * remaining
+                live_stop |= fired
+
+        stop[alive] = live_stop
+        self.finished.extend(state.fitness[live_rows[live_stop]])
+        return stop
+
+    def merge(self, stats):
+        for name, values in stats.items():
+            for key, value in values.items():
+                self.stats[name][key] += value
+
+    def reset_stats(self):
+        for values in self.stats.values():
+            for key in values:
+                values[key] = 0
+
+
+class EarlyStoppingReporter(neat.reporting.BaseReporter):
+    """Prints how many simulation steps every policy saved in the last generation."""
+    def __init__(self, early_stopping):
+        self.early_stopping = early_stopping
+
+    def post_evaluate(self, config, population, species, best_genome):
+        stats = self.early_stopping.stats
+        total = sum(values['steps_saved'] for values in stats.values())
+        parts = [f"{name} {values['steps_saved']} ({values['walkers']} walkers)" for name, values in stats.items()]
+        print(f"Early stopping saved {total} steps: " + ", ".join(parts))
+        self.early_stopping.reset_stats()
@@ -0,0 +1,100 @@
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+
+
+def genome_key(genome, salt=""):
+    """
+    Canonical hash of everything that decides how a genome behaves:
+    node biases, responses, activations and aggregations plus the enabled
+    connections and their weights. Disabled connections are ignored.
+    """
+    parts = [salt]
+    for key in sorted(genome.nodes):
+        node = genome.nodes[key]
+        parts.append(f"n{key}:{node.bias!r}:{node.response!r}:{node.activation}:{node.aggregation}")
+    for key in sorted(genome.connections):
+        conn = genome.connections[key]
+        if conn.enabled:
+            parts.append(f"c{key[0]},{key[1]}:{conn.weight!r}")
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+
+class FitnessCache:
+    """
+    Bounded LRU cache of genome fitness keyed by genome_key().
+
+    Only valid because an episode is deterministic, so the same genome always
+    scores the same. salt should change whenever the episode rules change.
+    """
+    def __init__(self, maxsize=10000, salt=""):
+        self.maxsize = maxsize
+        self.salt = salt
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, genome):
+        key = genome_key(genome, self.salt)
+        fitness = self.entries.get(key)
+        if fitness is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return fitness
+
+    def put(self, genome, fitness):
+        if self.maxsize <= 0 or fitness is None:
+            return
+        key = genome_key(genome, self.salt)
+        self.entries[key] = fitness
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def wrap(self, evaluate):
+        """Return an eval function that only simulates genomes missing from the cache."""
+        def cached_evaluate(genomes, config):
+            missing = []
+            for genome_id, genome in genomes:
+                fitness = self.get(genome)
+                if fitness is None:
+                    missing.append((genome_id, genome))
+                else:
+                    genome.fitness = fitness
+
+            if missing:
+                evaluate(missing, config)
+                for genome_id, genome in missing:
+                    self.put(genome, genome.fitness)
+        return cached_evaluate
+
+    def get_state(self):
+        return {"salt": self.salt, "entries": list(self.entries.items())}
+
+    def set_state(self, state):
+        if state.get("salt") != self.salt:
+            # cached under different episode rules, so none of it is valid
+            return
+        for key, fitness in state["entries"]:
+            self.entries[key] = fitness
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def save(self, path):
+        # write to a temp file first so an interrupted save never leaves a broken cache
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self.get_state(), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            self.set_state(pickle.load(f))
@@ -1,25 +1,92 @@
-import pygame
 import pymunk
-import pymunk.pygame_util
 import neat
+import numpy as np
 import os
 import math
 import random
+import argparse
+import multiprocessing
+import pickle
+import threading
+import time
+import json
+from collections import OrderedDict
+import csv
+
+from batched_net import create_networks
+from checkpoint import AsyncCheckpointer, restore_checkpoint
+from early_stopping import EarlyStopping, EarlyStoppingReporter
+from fitness_cache import FitnessCache
+from islands import IslandModel
+from multi_episode import EpisodeRacing, EpisodeRacingReporter
+from sensors import Sensor, compile_sensors
+from terrain import FLAT, TerrainCache
+from trajectory import TrajectoryFile, draw_poses
 
 SCREEN_WIDTH = 1500
 SCREEN_HEIGHT = 1000
 PHYSICS_STEPS = 1 / 60.0
 HUMANOID_COUNT = 50
+GENERATIONS = 1000
+
+# episode length and death wall speed are measured in physics steps, not wall time,
+# so a generation lasts the same simulated 60 s with or without a window
+SIMULATION_SECONDS = 60
+EPISODE_STEPS = int(round(SIMULATION_SECONDS / PHYSICS_STEPS))
+DEATH_WALL_SPEED = 5 * PHYSICS_STEPS  # pixels per physics step (5 px per simulated second)
+
+# stdev of the random initial body velocities (px/s) of an episode with a seed
+INITIAL_PERTURBATION = 20.0
 
-pygame.init()
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("NEAT Humanoid Walker - Improved")
-clock = pygame.time.Clock()
-draw_options = pymunk.pygame_util.DrawOptions(screen)
-font = pygame.font.SysFont("Arial", 20)
+# walkers only collide with the ground, never with each other
+GROUND_CATEGORY = 1 << 0
+WALKER_CATEGORY = 1 << 1
+
+# display stuff, only created by init_display() when running with a window
+HEADLESS = False
+# one small physics space per walker, see simulate()
+ISOLATED = True
+# EarlyStopping instance, None evaluates every walker for the whole episode
+EARLY_STOPPING = None
+# every RECORD_EVERY generations all simulated walkers are recorded to RECORD_PREFIX<generation>.traj
+RECORD_EVERY = 0
+RECORD_PREFIX = None
+# with a number, only that many of the best walkers of a recorded generation are recorded (see TopWalkerRecorder)
+RECORD_TOP = None
+# Renderer of the decoupled view, None draws in lockstep with the physics (or not at all when headless)
+RENDERER = None
+# Profiler timing the evaluation loop, None when profiling is off
+PROFILER = None
+# seed of the generated terrain of the plain episode, None walks on the flat ground
+TERRAIN_SEED = None
+screen = None
+clock = None
+font = None
 
 best_fitness_so_far = 0.0
 
+# pygame is only imported by the functions that draw, so headless runs, worker
+# processes and tools that just need the simulation never load it
+
+def init_display():
+    global screen, clock
+    import pygame
+
+    pygame.init()
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    pygame.display.set_caption("NEAT Humanoid Walker - Improved")
+    clock = pygame.time.Clock()
+
+def get_font():
+    # looking up a system font is slow, so it waits until the first text is drawn
+    global font
+    if font is None:
+        import pygame
+
+        pygame.font.init()
+        font = pygame.font.SysFont("Arial", 20)
+    return font
+
 class Humanoid:
     def __init__(self, space, position, collision_type_offset):
         self.space = space
@@ -28,15 +95,19 @@ class Humanoid:
         self.joints = {}
         self.initial_pos = position
         self.collision_type_base = collision_type_offset * 10
+        # ground segments each body (BODY_NAMES order) touches, counted by the collision
+        # handlers. during an episode this is the walker's row of PopulationState.contact_counts
+        self.contacts = np.zeros(len(BODY_NAMES), dtype=np.int8)
 
         self.create_body(position)
+        self.in_space = True
+        # where create_body() put every body, reset() returns them there
+        self.start_positions = [body.position for body in self.bodies.values()]
         self.is_alive = True
         self.fitness = 0.0
         self.max_x = position[0] 
         self.prev_x = position[0]
         self.prev_velocity = 0.0
-        self.steps_taken = 0
-        self.ground_contacts = {"left_foot": False, "right_foot": False}
         self.step_time = 0
 
     def create_body(self, pos):
@@ -46,7 +117,7 @@ class Humanoid:
         self.bodies['torso'] = pymunk.Body(15, 150)
         self.bodies['torso'].position = (x, y - 50)
         shape = pymunk.Poly.create_box(self.bodies['torso'], (20, 80))
-        shape.filter = pymunk.ShapeFilter(group=group_id, categories=1 << (self.collision_type_base % 32), mask=1)
+        shape.filter = pymunk.ShapeFilter(group=group_id, categories=WALKER_CATEGORY, mask=GROUND_CATEGORY)
         shape.color = (0, 0, 255, 255)
         shape.collision_type = self.collision_type_base + 1
         shape.friction = 0.3
@@ -55,7 +126,7 @@ class Humanoid:
         self.bodies['head'] = pymunk.Body(5, 50)
         self.bodies['head'].position = (x, y - 110)
         shape = pymunk.Circle(self.bodies['head'], 20)
-        shape.filter = pymunk.ShapeFilter(group=group_id, categories=1 << (self.collision_type_base % 32), mask=1)
+        shape.filter = pymunk.ShapeFilter(group=group_id, categories=WALKER_CATEGORY, mask=GROUND_CATEGORY)
         shape.color = (255, 0, 0, 255)
         shape.collision_type = self.collision_type_base + 2
         shape.friction = 0.3
@@ -69,7 +140,7 @@ class Humanoid:
             self.bodies[f'upper_leg_{i}'] = pymunk.Body(6, 100)
             self.bodies[f'upper_leg_{i}'].position = (x + x_offset, y - 5)
             shape = pymunk.Poly.create_box(self.bodies[f'upper_leg_{i}'], (12, 50))
-            shape.filter = pymunk.ShapeFilter(group=group_id, categories=1 << (self.collision_type_base % 32), mask=1)
+            shape.filter = pymunk.ShapeFilter(group=group_id, categories=WALKER_CATEGORY, mask=GROUND_CATEGORY)
             shape.color = (0, 255, 0, 255)
             shape.collision_type = self.collision_type_base + 3 + i*3
             shape.friction = 0.3
@@ -79,7 +150,7 @@ class Humanoid:
             self.bodies[f'lower_leg_{i}'] = pymunk.Body(4, 80)
             self.bodies[f'lower_leg_{i}'].position = (x + x_offset, y + 45)
             shape = pymunk.Poly.create_box(self.bodies[f'lower_leg_{i}'], (10, 40))
-            shape.filter = pymunk.ShapeFilter(group=group_id, categories=1 << (self.collision_type_base % 32), mask=1)
+            shape.filter = pymunk.ShapeFilter(group=group_id, categories=WALKER_CATEGORY, mask=GROUND_CATEGORY)
             shape.color = (0, 200, 50, 255)
             shape.collision_type = self.collision_type_base + 4 + i*3
             shape.friction = 0.3
@@ -89,7 +160,7 @@ class Humanoid:
             self.bodies[f'foot_{i}'] = pymunk.Body(2, 20)
             self.bodies[f'foot_{i}'].position = (x + x_offset, y + 75)
             shape = pymunk.Poly.create_box(self.bodies[f'foot_{i}'], (25, 8))
-            shape.filter = pymunk.ShapeFilter(group=group_id, categories=1 << (self.collision_type_base % 32), mask=1)
+            shape.filter = pymunk.ShapeFilter(group=group_id, categories=WALKER_CATEGORY, mask=GROUND_CATEGORY)
             shape.color = (100, 100, 100, 255)
             shape.collision_type = self.collision_type_base + 5 + i*3
             shape.friction = 1.0 
@@ -99,7 +170,17 @@ class Humanoid:
             self.space.add(body)
         for shape in self.shapes.values():
             self.space.add(shape)
+        self.add_contact_handlers()
+
+        self.create_joints()
+
+    def add_contact_handlers(self):
+        # the ground is collision type 0, begin and separate only run when a contact starts or ends
+        for index, name in enumerate(BODY_NAMES):
+            self.space.on_collision(self.shapes[name].collision_type, 0, begin=self.begin_contact,
+                                    separate=self.end_contact, data=index)
 
+    def create_joints(self):
         # Joints and motors and magic stuff :)
         self.joints['head_joint'] = pymunk.PivotJoint(self.bodies['torso'], self.bodies['head'], (0, -40), (0, 20))
         self.joints['head_joint'].collide_bodies = False
@@ -165,46 +246,6 @@ class Humanoid:
             
             self.space.add(self.joints[f'ankle_joint_{i}'], self.joints[f'ankle_motor_{i}'], self.joints[f'ankle_limit_{i}'])
 
-    def get_inputs(self, wall_x):
-        inputs = []
-        
-        # body orientation and angular velocity
-        inputs.append(self.bodies['torso'].angle / math.pi)
-        inputs.append(self.bodies['torso'].angular_velocity / 10.0)
-        
-        # torso velocity (important for movement allegedly :D)
-        inputs.append(self.bodies['torso'].velocity.x / 100.0)
-        inputs.append(self.bodies['torso'].velocity.y / 100.0)
-        
-        #jJoint angles for both legs 
-        for i in range(2):
-            # Hip angle
-            hip_angle = self.bodies[f'upper_leg_{i}'].angle - self.bodies['torso'].angle
-            inputs.append(hip_angle / math.pi)
-            
-            # Knee angle
-            knee_angle = self.bodies[f'lower_leg_{i}'].angle - self.bodies[f'upper_leg_{i}'].angle
-            inputs.append(knee_angle / math.pi)
-            
-            # ankle angle
-            ankle_angle = self.bodies[f'foot_{i}'].angle - self.bodies[f'lower_leg_{i}'].angle
-            inputs.append(ankle_angle / math.pi)
-            
-            # foot ground contact 
-            foot_y = self.bodies[f'foot_{i}'].position.y
-            ground_level = SCREEN_HEIGHT - 100
-            inputs.append(1.0 if foot_y >= ground_level - 15 else 0.0)
-
-        # head height relative to start
-        head_height = (self.bodies['head'].position.y - self.initial_pos[1]) / SCREEN_HEIGHT
-        inputs.append(head_height)
-        
-        # distance traveled
-        distance = (self.bodies['torso'].position.x - self.initial_pos[0]) / SCREEN_WIDTH
-        inputs.append(distance)
-
-        return inputs
-
     def apply_outputs(self, outputs):
         if not self.is_alive:
             return
@@ -219,110 +260,294 @@ class Humanoid:
             self.joints['knee_motor_1'].rate = outputs[4] * motor_speed
             self.joints['ankle_motor_1'].rate = outputs[5] * motor_speed
 
-    def check_fall(self, wall_x=None):
-        ground_level = SCREEN_HEIGHT - 100
+    def begin_contact(self, arbiter, space, index):
+        self.contacts[index] += 1
+
+    def end_contact(self, arbiter, space, index):
+        # contacts from before reset() end during the first step after it, when the count was already zeroed
+        if self.contacts[index] > 0:
+            self.contacts[index] -= 1
+
+    def remove_from_space(self):
+        # space.constraints and friends build a new list on every access, so don't search them
+        if not self.in_space:
+            return
+        self.space.remove(*self.joints.values(), *self.shapes.values(), *self.bodies.values())
+        self.in_space = False
+
+    def move_to_space(self, space):
+        """Take bodies, shapes and joints out of the walker's space and put them into space."""
+        self.remove_from_space()
+        self.space = space
+        self.space.add(*self.bodies.values(), *self.shapes.values(), *self.joints.values())
+        self.add_contact_handlers()
+        self.in_space = True
+
+    def reset(self, position):
+        """
+        Put the walker back into its starting pose at position, at rest, with
+        everything zeroed that a fresh Humanoid would start with.
+        """
+        dx = position[0] - self.initial_pos[0]
+        dy = position[1] - self.initial_pos[1]
+
+        # the shapes stay in the space, re-adding them would give them new hash ids and
+        # change the order contacts are solved in. their old contacts expire on their
+        # own before the walker falls back onto the ground
+        self.space.remove(*self.joints.values())
+        for body, (x, y) in zip(self.bodies.values(), self.start_positions):
+            # a zero length step only clears the bias velocities the solver left behind
+            pymunk.Body.update_position(body, 0.0)
+            body.position = (x + dx, y + dy)
+            body.angle = 0
+            body.velocity = (0, 0)
+            body.angular_velocity = 0
+            body.force = (0, 0)
+            body.torque = 0
+        self.start_positions = [body.position for body in self.bodies.values()]
+        # constraints keep their accumulated impulses for warm starting and there is
+        # no way to clear them, new ones are the only way to get a fresh solver state
+        self.create_joints()
+
+        self.initial_pos = position
+        self.is_alive = True
+        self.fitness = 0.0
+        self.max_x = position[0]
+        self.prev_x = position[0]
+        self.prev_velocity = 0.0
+        self.contacts = np.zeros(len(BODY_NAMES), dtype=np.int8)
+        self.step_time = 0
+
+class WalkerPool:
+    """
+    Isolated walkers (each in its own space) kept between episodes.
+
+    Building a walker and its space costs more than twice as much as
+    resetting one, so every process builds as many as its largest episode
+    needs once and resets them afterwards. A reset walker behaves bit for bit
+    like a new one.
+
+    Each walker also keeps a space with the ground of each of the last
+    max_terrains terrains it walked on. Switching terrain moves the walker's
+    few bodies into the space of the new terrain instead of moving the whole
+    course, so it costs the same however long the course is.
+    """
+    def __init__(self, max_terrains=8):
+        self.max_terrains = max_terrains
+        self.free = []
+        # walker -> terrain key -> space with only that terrain's ground, the walker is in the last one
+        self.spaces = {}
+
+    def acquire(self, position, terrain=FLAT):
+        if not self.free:
+            space = create_world(terrain)
+            humanoid = Humanoid(space, position, 0)
+            self.spaces[humanoid] = OrderedDict([(terrain.key, space)])
+            return humanoid
+        humanoid = self.free.pop()
+        self.set_terrain(humanoid, terrain)
+        humanoid.reset(position)
+        return humanoid
+
+    def set_terrain(self, humanoid, terrain):
+        spaces = self.spaces[humanoid]
+        current = next(reversed(spaces))
+        if current == terrain.key:
+            return
+        space = spaces.pop(terrain.key, None)
+        if space is None:
+            space = create_world(terrain)
+        humanoid.move_to_space(space)
+        spaces[terrain.key] = space
+        while len(spaces) > self.max_terrains:
+            spaces.popitem(last=False)
+
+    def release(self, humanoids):
+        self.free.extend(humanoids)
+
+walker_pool = WalkerPool()
+# generated terrains of this process, built on first use
+terrain_cache = TerrainCache()
+
+# body order inside PopulationState, matches the order create_body() makes them
+BODY_NAMES = ('torso', 'head',
+              'upper_leg_0', 'lower_leg_0', 'foot_0',
+              'upper_leg_1', 'lower_leg_1', 'foot_1')
+TORSO, HEAD, UPPER_LEG_0, LOWER_LEG_0, FOOT_0, UPPER_LEG_1, LOWER_LEG_1, FOOT_1 = range(len(BODY_NAMES))
+UPPER_LEGS = (UPPER_LEG_0, UPPER_LEG_1)
+LOWER_LEGS = (LOWER_LEG_0, LOWER_LEG_1)
+FEET = (FOOT_0, FOOT_1)
+
+# fields of every body in the snapshot
+PX, PY, ANGLE, VX, VY, ANGULAR_VEL = range(6)
+
+# the network inputs in input order, num_inputs in config-feedforward.txt has to match
+SENSORS = [
+    # body orientation and angular velocity
+    Sensor('torso_angle', 'torso', 'angle', scale=math.pi),
+    Sensor('torso_angular_velocity', 'torso', 'angular_velocity', scale=10.0),
+    # torso velocity (important for movement allegedly :D)
+    Sensor('torso_vx', 'torso', 'vx', scale=100.0),
+    Sensor('torso_vy', 'torso', 'vy', scale=100.0),
+    # joint angles and foot contact for both legs
+    Sensor('hip_0', 'upper_leg_0', 'angle', relative_to='torso', scale=math.pi),
+    Sensor('knee_0', 'lower_leg_0', 'angle', relative_to='upper_leg_0', scale=math.pi),
+    Sensor('ankle_0', 'foot_0', 'angle', relative_to='lower_leg_0', scale=math.pi),
+    Sensor('contact_0', 'foot_0', kind='contact'),
+    Sensor('hip_1', 'upper_leg_1', 'angle', relative_to='torso', scale=math.pi),
+    Sensor('knee_1', 'lower_leg_1', 'angle', relative_to='upper_leg_1', scale=math.pi),
+    Sensor('ankle_1', 'foot_1', 'angle', relative_to='lower_leg_1', scale=math.pi),
+    Sensor('contact_1', 'foot_1', kind='contact'),
+    # head height relative to start (above the ground below the head)
+    Sensor('head_height', 'head', kind='height', scale=SCREEN_HEIGHT),
+    # distance traveled
+    Sensor('distance', 'torso', kind='distance', scale=SCREEN_WIDTH),
+]
+SENSOR_PIPELINE = compile_sensors(SENSORS, BODY_NAMES)
+
+class PopulationState:
+    """
+    Structure of arrays snapshot of every body of every walker.
+
+    update() reads all bodies in one pass into the preallocated data array of
+    shape (walkers, bodies, fields), everything else is computed vectorized from it.
+    """
+    def __init__(self, humanoids, terrain=FLAT):
+        self.bodies = [[humanoid.bodies[name] for name in BODY_NAMES] for humanoid in humanoids]
+        self.initial_pos = np.array([humanoid.initial_pos for humanoid in humanoids], dtype=np.float64).reshape(-1, 2)
+        self.terrain = terrain
+        # heights are measured from the ground below a body, spawn_height is how high the walkers started
+        self.spawn_height = terrain.height_at(self.initial_pos[:, 0]) - self.initial_pos[:, 1]
+        self.data = np.zeros((len(humanoids), len(BODY_NAMES), 6))
+        # the walkers' collision handlers count their ground contacts straight into this array,
+        # update() turns it into the contacts bitmap
+        self.contact_counts = np.zeros((len(humanoids), len(BODY_NAMES)), dtype=np.int8)
+        for row, humanoid in enumerate(humanoids):
+            humanoid.contacts = self.contact_counts[row]
+        self.contacts = np.zeros((len(humanoids), len(BODY_NAMES)), dtype=bool)
+        # a step is a foot touching down after the other one did, last_foot is the foot that touched down last
+        self.steps_taken = np.zeros(len(humanoids), dtype=np.int64)
+        self.last_foot = np.full(len(humanoids), -1)
+
+        self.fitness = np.zeros(len(humanoids))
+        # pose penalty terms of the last fitness update, they come and go with the pose (see EarlyStopping)
+        self.ground_penalty = np.zeros(len(humanoids))
+        self.leg_spread_penalty = np.zeros(len(humanoids))
+        self.max_x = self.initial_pos[:, 0].copy()
+        self.step_time = np.zeros(len(humanoids), dtype=np.int64)
+
+    def update(self, rows):
+        # position and velocity are Vec2d tuples, unpacking reads each of them only once
+        values = [(*body.position, body.angle, *body.velocity, body.angular_velocity)
+                  for row in rows for body in self.bodies[row]]
+        if values:
+            self.data[rows] = np.array(values).reshape(len(rows), len(BODY_NAMES), 6)
+
+        contacts = self.contact_counts[rows] > 0
+        touched_down = contacts[:, FEET] & ~self.contacts[rows][:, FEET]
+        # both feet landing in the same step (like after spawning) isn't a step
+        last_foot = self.last_foot[rows]
+        for i in range(2):
+            self.steps_taken[rows] += touched_down[:, i] & (last_foot >= 0) & (last_foot != i)
+            self.last_foot[rows[touched_down[:, i]]] = i
+        self.contacts[rows] = contacts
+
+    def sensor_inputs(self, rows, wall_x=None):
+        """The network inputs (see SENSORS) for the given rows."""
+        return SENSOR_PIPELINE.compute(self, rows, wall_x)
+
+    def check_fall(self, rows, wall_x=None):
+        """Boolean mask over rows of the walkers that fell, tipped over or got caught by the wall."""
+        data = self.data[rows]
+        ground = self.terrain.height_at
         margin = -15
-        
+
         # head or torso hit ground detectioin
-        if (self.bodies['head'].position.y >= ground_level + margin or 
-            self.bodies['torso'].position.y >= ground_level + margin):
-            self.is_alive = False
-            return
-            
-        
+        fallen = ((data[:, HEAD, PY] >= ground(data[:, HEAD, PX]) + margin) |
+                  (data[:, TORSO, PY] >= ground(data[:, TORSO, PX]) + margin))
         # titlt detection
-        if abs(self.bodies['torso'].angle) > math.pi/2:
-            self.is_alive = False
-            return
-        
+        fallen |= np.abs(data[:, TORSO, ANGLE]) > math.pi/2
         # wall detection
         if wall_x is not None:
-            if self.bodies['torso'].position.x < wall_x - 15:
-                self.is_alive = False
-                return
+            fallen |= data[:, TORSO, PX] < wall_x - 15
+        return fallen
+
+    def calculate_fitness(self, rows, outputs, motor_speed=4.0):
+        """
+        Update fitness of the given rows from the current snapshot.
+
+        outputs are the network outputs applied this step, the motor rates are
+        outputs * motor_speed (see Humanoid.apply_outputs).
+        """
+        data = self.data[rows]
+        torso = data[:, TORSO]
+        head = data[:, HEAD]
+        initial_pos = self.initial_pos[rows]
 
-    def calculate_fitness(self):
         # distance
-        x_distance = self.bodies['torso'].position.x - self.initial_pos[0]
-        self.max_x = max(self.max_x, self.bodies['torso'].position.x)
-        
+        x_distance = torso[:, PX] - initial_pos[:, 0]
+        self.max_x[rows] = np.maximum(self.max_x[rows], torso[:, PX])
+
         # velocity
-        velocity = self.bodies['torso'].velocity.x
-        velocity_bonus = max(0, velocity / 50.0) 
-        
+        velocity_bonus = np.maximum(0, torso[:, VX] / 50.0)
+
         # upright
-        torso_angle = abs(self.bodies['torso'].angle)
-        upright_bonus = max(0, (math.pi/3 - torso_angle) / (math.pi/3))
-        
-        # head height - 
-        head_height = self.bodies['head'].position.y
-        target_height = self.initial_pos[1] - 110
-        height_bonus = max(0, 1.0 - abs(head_height - target_height) / 100.0)
-        
+        torso_angle = np.abs(torso[:, ANGLE])
+        upright_bonus = np.maximum(0, (math.pi/3 - torso_angle) / (math.pi/3))
+
+        # head height
+        head_ground = self.terrain.height_at(head[:, PX])
+        target_height = head_ground - self.spawn_height[rows] - 110
+        height_bonus = np.maximum(0, 1.0 - np.abs(head[:, PY] - target_height) / 100.0)
+
         # stability bonus (penalize excessive rotation)
-        angular_vel = abs(self.bodies['torso'].angular_velocity)
-        stability_bonus = max(0, 1.0 - angular_vel / 10.0)
-        
-        # leg movement bonus (encourage leg usage)
-        leg_movement = 0
-        for i in range(2):
-            leg_movement += abs(self.joints[f'hip_motor_{i}'].rate)
-            leg_movement += abs(self.joints[f'knee_motor_{i}'].rate)
-            if f'ankle_motor_{i}' in self.joints:
-                leg_movement += abs(self.joints[f'ankle_motor_{i}'].rate)
-        leg_movement_bonus = min(1.0, leg_movement / 10.0)
-        
+        stability_bonus = np.maximum(0, 1.0 - np.abs(torso[:, ANGULAR_VEL]) / 10.0)
+
+        # leg movement bonus (encourage leg usage), summed in hip/knee/ankle order like the motors
+        leg_movement = np.zeros(len(rows))
+        for k in range(outputs.shape[1]):
+            leg_movement += np.abs(outputs[:, k] * motor_speed)
+        leg_movement_bonus = np.minimum(1.0, leg_movement / 10.0)
+
         # penalize legs too far apart
-        leg_distance = abs(self.bodies['upper_leg_0'].position.x - self.bodies['upper_leg_1'].position.x)
-        leg_spread_penalty = 0.0
+        leg_distance = np.abs(data[:, UPPER_LEG_0, PX] - data[:, UPPER_LEG_1, PX])
         leg_spread_threshold = 30.0
-        if leg_distance > leg_spread_threshold:
-            leg_spread_penalty = (leg_distance - leg_spread_threshold) * 50.0 
+        leg_spread_penalty = np.where(leg_distance > leg_spread_threshold,
+                                      (leg_distance - leg_spread_threshold) * 50.0, 0.0)
 
-        # feet facing ground bonus 
-        feet_facing_bonus = 0
+        # feet facing ground bonus
+        feet_facing_bonus = np.zeros(len(rows))
         for i in range(2):
-            ankle_angle = self.bodies[f'foot_{i}'].angle - self.bodies[f'lower_leg_{i}'].angle
-            feet_facing_bonus += max(0, 1.0 - abs(ankle_angle) / (math.pi / 2))
-        feet_facing_bonus = (feet_facing_bonus / 2.0) * 10.0 
+            ankle_angle = data[:, FEET[i], ANGLE] - data[:, LOWER_LEGS[i], ANGLE]
+            feet_facing_bonus += np.maximum(0, 1.0 - np.abs(ankle_angle) / (math.pi / 2))
+        feet_facing_bonus = (feet_facing_bonus / 2.0) * 10.0
 
         # penalize torso and head that are too close to the ground
-        ground_level = SCREEN_HEIGHT - 100
-        torso_y = self.bodies['torso'].position.y
-        head_y = self.bodies['head'].position.y
-        torso_ground_penalty = max(0, 1.0 - (ground_level - torso_y) / 120.0) * 35.0
-        head_ground_penalty = max(0, 1.0 - (ground_level - head_y) / 120.0) * 45.0
+        torso_ground = self.terrain.height_at(torso[:, PX])
+        torso_ground_penalty = np.maximum(0, 1.0 - (torso_ground - torso[:, PY]) / 120.0) * 35.0
+        head_ground_penalty = np.maximum(0, 1.0 - (head_ground - head[:, PY]) / 120.0) * 45.0
 
         # combine alll
-        self.fitness = (
-            x_distance * 0.1 +      
-            velocity_bonus * 2.0 +             
-            upright_bonus * 25.0 +             
-            height_bonus * 39.0 +              
-            stability_bonus * 10.0 +        
-            leg_movement_bonus * 8.0 +  
-            feet_facing_bonus             
-            - torso_ground_penalty           
-            - head_ground_penalty            
-            - leg_spread_penalty   
+        fitness = (
+            x_distance * 0.1 +
+            velocity_bonus * 2.0 +
+            upright_bonus * 25.0 +
+            height_bonus * 39.0 +
+            stability_bonus * 10.0 +
+            leg_movement_bonus * 8.0 +
+            feet_facing_bonus
+            - torso_ground_penalty
+            - head_ground_penalty
+            - leg_spread_penalty
         )
-        
-
-        self.step_time += 1
-        self.fitness += self.step_time * 0.01
 
-    def remove_from_space(self):
-        for joint in self.joints.values():
-            if joint in self.space.constraints:
-                self.space.remove(joint)
-        for shape in self.shapes.values():
-            if shape in self.space.shapes:
-                self.space.remove(shape)
-        for body in self.bodies.values():
-            if body in self.space.bodies:
-                self.space.remove(body)
+        self.step_time[rows] += 1
+        self.fitness[rows] = fitness + self.step_time[rows] * 0.01
+        self.ground_penalty[rows] = torso_ground_penalty + head_ground_penalty
+        self.leg_spread_penalty[rows] = leg_spread_penalty
 
 def draw_neural_network(surface, genome, config, position, width, height):
+    import pygame
 
     x, y = position
     node_radius = 8
@@ -366,178 +591,758 @@ def draw_neural_network(surface, genome, config, position, width, height):
                 pygame.draw.line(surface, color, start_pos, end_pos, line_width)
 
     # draw nodes
+    input_index = {key: i for i, key in enumerate(input_keys)}
+    output_index = {key: i for i, key in enumerate(output_keys)}
     for key, pos in node_positions.items():
         color = (200, 200, 200)
-        if key in input_keys: color = (100, 100, 255)
-        elif key in output_keys: color = (255, 100, 100)
+        if key in input_index: color = (100, 100, 255)
+        elif key in output_index: color = (255, 100, 100)
         
         pygame.draw.circle(surface, color, pos, node_radius)
         pygame.draw.circle(surface, (0,0,0), pos, node_radius, 1)
 
 
         label_text = ""
-        if key in input_keys:
-            idx = input_keys.index(key)
+        if key in input_index:
+            idx = input_index[key]
             if idx < len(input_names): label_text = input_names[idx][:6] 
-        elif key in output_keys:
-            idx = output_keys.index(key)
+        elif key in output_index:
+            idx = output_index[key]
             if idx < len(output_names): label_text = output_names[idx]
         else:
             label_text = str(key)
             
         if label_text:
-            label_surface = font.render(label_text, True, (0,0,0))
+            label_surface = render_label(label_text)
             label_pos = (pos[0] + 12, pos[1] - 8)
-            if key in input_keys:
+            if key in input_index:
                 label_pos = (pos[0] - label_surface.get_width() - 12, pos[1] - 8)
             surface.blit(label_surface, label_pos)
 
-def eval_genomes(genomes, config):
+# prerendered label glyphs, node labels never change
+label_surfaces = {}
 
-    global best_fitness_so_far
-    
+def render_label(text):
+    label_surface = label_surfaces.get(text)
+    if label_surface is None:
+        label_surface = label_surfaces[text] = get_font().render(text, True, (0,0,0))
+    return label_surface
+
+# the network panel of the last drawn genome, redrawn only when the genome changes
+nn_panel_cache = {'key': None, 'surface': None}
+NN_PANEL_MARGIN = 120  # room for the labels sticking out left and right of the panel
+
+def draw_network_panel(surface, genome, config, rect):
+    import pygame
+
+    key = (genome.key,
+           tuple(sorted(genome.nodes)),
+           tuple(sorted((conn.key, conn.weight) for conn in genome.connections.values() if conn.enabled)))
+    if key != nn_panel_cache['key']:
+        panel = pygame.Surface((rect.width + 2 * NN_PANEL_MARGIN, rect.height), pygame.SRCALPHA)
+        panel_rect = pygame.Rect(NN_PANEL_MARGIN, 0, rect.width, rect.height)
+        pygame.draw.rect(panel, (240, 240, 240), panel_rect)
+        pygame.draw.rect(panel, (0, 0, 0), panel_rect, 2)
+        draw_neural_network(panel, genome, config, (panel_rect.x + 10, panel_rect.y + 10), panel_rect.width - 20, panel_rect.height - 20)
+        nn_panel_cache['key'] = key
+        nn_panel_cache['surface'] = panel
+    surface.blit(nn_panel_cache['surface'], (rect.x - NN_PANEL_MARGIN, rect.y))
+
+def create_world(terrain=FLAT):
+    space = create_space()
+    space.add(*create_ground(space, terrain))
+    return space
+
+def create_space():
     space = pymunk.Space()
     space.gravity = (0, 1200) 
+    return space
 
-    spawn_pos = (150, SCREEN_HEIGHT - 200)
+def create_ground(space, terrain):
+    """Static segments of terrain for space, not added to it yet."""
+    shapes = []
+    for a, b in terrain.segments():
+        ground = pymunk.Segment(space.static_body, a, b, 8)
+        ground.friction = 1.0
+        ground.collision_type = 0
+        ground.filter = pymunk.ShapeFilter(categories=GROUND_CATEGORY)
+        shapes.append(ground)
+    # neighbours stop bodies from catching on the inner ends of the segments
+    for i, ground in enumerate(shapes):
+        if len(shapes) > 1:
+            ground.set_neighbors(shapes[i - 1].a if i > 0 else ground.a,
+                                 shapes[i + 1].b if i + 1 < len(shapes) else ground.b)
+    return shapes
+
+def restore_constraint_order(space, humanoids):
+    # pymunk removes a constraint by moving the last one into its slot, which changes
+    # the solver order of the survivors (and so their fitness). re-adding them in
+    # creation order keeps every walker's result independent of who else died
+    constraints = [joint for humanoid in humanoids for joint in humanoid.joints.values()]
+    if constraints:
+        space.remove(*constraints)
+        space.add(*constraints)
+
+class Profiler(neat.reporting.BaseReporter):
+    """
+    Splits every generation's evaluation time into the sections of the
+    simulate() loop and writes one row per generation to path, CSV if the
+    name ends in .csv and JSON lines otherwise.
+
+    With worker processes every worker times its own loop and the sections
+    add up the time of all workers, so they can sum to more than the
+    evaluation wall time. "other" is whatever the sections don't cover
+    (fitness cache, pickling, waiting for workers and so on).
+    """
+    SECTIONS = ('setup', 'sensors', 'activation', 'physics', 'fitness', 'bookkeeping', 'render')
+
+    def __init__(self, path=None, workers=1):
+        self.path = path
+        self.workers = workers
+        self.generation = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = dict.fromkeys(self.SECTIONS, 0.0)
+        self.stats['walkers'] = 0
+        self.stats['walker_steps'] = 0
+        self.last = time.perf_counter()
+
+    def mark(self):
+        self.last = time.perf_counter()
+
+    def lap(self, section):
+        """Add the time since the last lap() or mark() to section."""
+        now = time.perf_counter()
+        self.stats[section] += now - self.last
+        self.last = now
 
-    ground = pymunk.Segment(space.static_body, (-2000, SCREEN_HEIGHT - 100), (20000, SCREEN_HEIGHT - 100), 8)
-    ground.friction = 1.0
-    ground.collision_type = 0
-    space.add(ground)
+    def merge(self, stats):
+        for key, value in stats.items():
+            self.stats[key] += value
+
+    def start_generation(self, generation):
+        self.generation = generation
+        self.reset_stats()
+        self.generation_start = time.perf_counter()
+
+    def post_evaluate(self, config, population, species, best_genome):
+        self.evaluation_time = time.perf_counter() - self.generation_start
+
+    def end_generation(self, config, population, species_set):
+        evaluation = self.evaluation_time
+        row = {
+            'generation': self.generation,
+            'wall': time.perf_counter() - self.generation_start,
+            'evaluation': evaluation,
+        }
+        for section in self.SECTIONS:
+            row[section] = self.stats[section]
+        row['other'] = max(0.0, evaluation * self.workers - sum(self.stats[section] for section in self.SECTIONS))
+        row['workers'] = self.workers
+        row['walkers'] = self.stats['walkers']
+        row['walker_steps'] = self.stats['walker_steps']
+        row['steps_per_second'] = self.stats['walker_steps'] / evaluation if evaluation > 0 else 0.0
+        row['walkers_per_second'] = self.stats['walkers'] / evaluation if evaluation > 0 else 0.0
+        self.write(row)
+
+    def write(self, row):
+        if self.path is None:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # appending keeps the rows of a run that was resumed from a checkpoint
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        with open(self.path, 'a', newline='') as f:
+            if self.path.endswith('.csv'):
+                writer = csv.DictWriter(f, fieldnames=list(row))
+                if new_file:
+                    writer.writeheader()
+                writer.writerow(row)
+            else:
+                f.write(json.dumps(row) + '\n')
+
+def create_generation_trajectory(genomes):
+    if not RECORD_EVERY or RECORD_TOP or p.generation % RECORD_EVERY:
+        return None
+    path = f"{RECORD_PREFIX}{p.generation}.traj"
+    return TrajectoryFile.create(path, [genome_id for genome_id, _ in genomes], EPISODE_STEPS, PHYSICS_STEPS, p.generation,
+                                 TERRAIN_SEED)
+
+class TopWalkerRecorder(neat.reporting.BaseReporter):
+    """
+    Records the best `top` walkers of every `every`-th generation to prefix<generation>.traj.
+
+    Which walkers are the best is only known once the generation has been
+    evaluated, so they walk the plain episode again on their own afterwards.
+    With a space per walker that gives the same poses as in the evaluation,
+    except that early stopping doesn't cut them short. The file only has room
+    for these walkers, a few MB instead of a hundred.
+    """
+    def __init__(self, every, prefix, top):
+        self.every = every
+        self.prefix = prefix
+        self.top = top
+        self.generation = None
+
+    def start_generation(self, generation):
+        self.generation = generation
+
+    def post_evaluate(self, config, population, species, best_genome):
+        global best_fitness_so_far
+        if self.generation % self.every:
+            return
+        ranked = sorted(population.items(), key=lambda item: item[1].fitness, reverse=True)[:self.top]
+        genome_ids = [genome_id for genome_id, _ in ranked]
+        trajectory = TrajectoryFile.create(f"{self.prefix}{self.generation}.traj", genome_ids, EPISODE_STEPS,
+                                           PHYSICS_STEPS, self.generation, TERRAIN_SEED)
+        recorder = trajectory.recorder(genome_ids)
+        # walking again must not change the fitness the reproduction selects by
+        fitness = [genome.fitness for _, genome in ranked]
+        best_so_far = best_fitness_so_far
+        simulate(ranked, config, headless=True, isolated=ISOLATED, recorder=recorder,
+                 terrain=terrain_cache.get(TERRAIN_SEED))
+        recorder.close()
+        for (_, genome), genome_fitness in zip(ranked, fitness):
+            genome.fitness = genome_fitness
+        best_fitness_so_far = best_so_far
+
+def episode_terrain_seed(seed):
+    # the seeded episodes of multi-episode evaluation each walk on their own terrain
+    if TERRAIN_SEED is None:
+        return None
+    return TERRAIN_SEED + (seed or 0)
+
+def eval_genomes(genomes, config, seed=None):
+    # only the plain episode is recorded
+    trajectory = create_generation_trajectory(genomes) if seed is None else None
+    recorder = trajectory.recorder([genome_id for genome_id, _ in genomes]) if trajectory else None
+    simulate(genomes, config, headless=HEADLESS, isolated=ISOLATED, early_stopping=EARLY_STOPPING, seed=seed,
+             recorder=recorder, renderer=RENDERER, profiler=PROFILER, terrain=terrain_cache.get(episode_terrain_seed(seed)))
+    if recorder is not None:
+        recorder.close()
+
+def perturb(humanoid, seed, strength=INITIAL_PERTURBATION):
+    # every walker of an episode gets the same push, so a seed is a fair test for all of them
+    rng = random.Random(seed)
+    for name in BODY_NAMES:
+        humanoid.bodies[name].velocity = (rng.gauss(0, strength), rng.gauss(0, strength))
+
+def simulate(genomes, config, headless=False, isolated=True, early_stopping=None, seed=None, recorder=None,
+             renderer=None, profiler=None, terrain=FLAT):
+    """
+    Run one episode with all the given genomes.
+
+    Sets genome.fitness on every genome. With headless=True nothing is drawn
+    and the loop is not capped at 60 FPS.
+
+    With isolated=True (the default) every walker gets its own small space, so
+    collision work grows linearly with the population and a dead walker is
+    dropped together with its space. It is also the only mode where a walker's
+    contacts can't be reordered by other walkers, so fitness depends on nothing
+    but the genome. isolated=False puts everybody into one shared space.
+
+    early_stopping is an optional EarlyStopping that ends hopeless walkers'
+    episodes before they fall or run out of time. With a seed every walker
+    starts with the same random push (see perturb()), seed=None is the plain
+    training episode. recorder.record(step, state, rows) is called with the
+    state snapshot after every physics step. renderer is a Renderer that
+    gets snapshots published instead of drawing every step (use it with
+    headless=True). profiler is a Profiler that gets the time of every part
+    of the loop added to it. terrain is the ground everybody walks on (see
+    terrain.py).
+
+    Returns the number of walker steps simulated.
+    """
+    global best_fitness_so_far
+    if not headless:
+        import pygame
+
+    if config.genome_config.num_inputs != len(SENSOR_PIPELINE):
+        raise ValueError(f"config has {config.genome_config.num_inputs} inputs, SENSORS defines {len(SENSOR_PIPELINE)}")
+    lap = profiler.lap if profiler is not None else lambda section: None
+    if profiler is not None:
+        profiler.mark()
+
+    space = None if isolated else create_world(terrain)
+    spawn_pos = (150, SCREEN_HEIGHT - 200)
 
     humanoids = []
-    nets = []
     ge = []
 
+    # all networks are evaluated together in one vectorized pass per step
+    nets = create_networks([genome for _, genome in genomes], config)
+
     for i, (genome_id, genome) in enumerate(genomes):
         genome.fitness = 0
-        net = neat.nn.FeedForwardNetwork.create(genome, config)
-        nets.append(net)
-        humanoid = Humanoid(space, spawn_pos, i)
+        humanoid = walker_pool.acquire(spawn_pos, terrain) if isolated else Humanoid(space, spawn_pos, i)
+        if seed is not None:
+            perturb(humanoid, seed)
         humanoids.append(humanoid)
         ge.append(genome)
 
+    # row of each live humanoid in the batched networks and the state snapshot
+    walkers = humanoids
+    rows = np.arange(len(humanoids))
+    state = PopulationState(humanoids, terrain)
+    state.update(rows)
+    if early_stopping is not None:
+        early_stopping.start(len(humanoids), EPISODE_STEPS)
+    if recorder is not None:
+        recorder.record(0, state, rows)
+    lap('setup')
+
     running = True
-    start_time = pygame.time.get_ticks()
-    simulation_duration = 60000  
+    step = 0
+    walker_steps = 0
     wall_screen_x = spawn_pos[0] - 150  
     while running and len(humanoids) > 0:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                quit()
+        if not headless:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    pygame.quit()
+                    quit()
+            lap('render')
+
+        inputs = state.sensor_inputs(rows, wall_screen_x)
+        lap('sensors')
+        outputs = nets.activate(inputs, rows)
+        lap('activation')
+        for humanoid, humanoid_outputs in zip(humanoids, outputs):
+            humanoid.apply_outputs(humanoid_outputs)
 
-        if pygame.time.get_ticks() - start_time > simulation_duration:
+        if isolated:
+            for humanoid in humanoids:
+                humanoid.space.step(PHYSICS_STEPS)
+        else:
+            space.step(PHYSICS_STEPS)
+        lap('physics')
+        state.update(rows)
+        lap('sensors')
+        walker_steps += len(rows)
+        step += 1
+        if recorder is not None:
+            recorder.record(step, state, rows)
+        if step >= EPISODE_STEPS:
             running = False
+        lap('bookkeeping')
 
-        current_wall_x = -10000
-        for i, humanoid in enumerate(humanoids):
-            if humanoid.is_alive:
-                inputs = humanoid.get_inputs(current_wall_x)
-                outputs = nets[i].activate(inputs)
-                humanoid.apply_outputs(outputs)
+        alive = ~state.check_fall(rows, wall_screen_x)
+        state.calculate_fitness(rows[alive], outputs[alive])
+        lap('fitness')
+        if early_stopping is not None:
+            alive &= ~early_stopping.check(state, rows, alive, step)
 
-        space.step(PHYSICS_STEPS)
-        
-        best_humanoid_this_gen = None
-        current_max_fitness = -1e9
-        
-        alive_humanoids = [h for h in humanoids if h.is_alive]
-        for humanoid in alive_humanoids:
-            humanoid.check_fall(wall_screen_x)
-            
-            if humanoid.is_alive:
-                humanoid.calculate_fitness()
-                original_index = humanoids.index(humanoid)
-                ge[original_index].fitness = humanoid.fitness
-
-                if humanoid.fitness > current_max_fitness:
-                    current_max_fitness = humanoid.fitness
-                    best_humanoid_this_gen = humanoid
-                    if humanoid.fitness > best_fitness_so_far:
-                        best_fitness_so_far = humanoid.fitness
-
-        for i in range(len(humanoids) - 1, -1, -1):
-            if not humanoids[i].is_alive:
-                humanoids[i].remove_from_space()
-                humanoids.pop(i)
-                nets.pop(i)
-                ge.pop(i)
-        
-        if not humanoids:
-             running = False
+        if not alive.all():
+            for humanoid, genome, row, is_alive in zip(humanoids, ge, rows, alive):
+                if not is_alive:
+                    humanoid.is_alive = False
+                    if not isolated:
+                        humanoid.remove_from_space()
+                    genome.fitness = float(state.fitness[row])
+            humanoids = [humanoid for humanoid, is_alive in zip(humanoids, alive) if is_alive]
+            ge = [genome for genome, is_alive in zip(ge, alive) if is_alive]
+            rows = rows[alive]
+            if not isolated:
+                restore_constraint_order(space, humanoids)
 
-        screen.fill((135, 206, 235)) # sky col
-        
-        # camera follow
-        camera_x = 0
-        if best_humanoid_this_gen:
-            camera_x = max(0, best_humanoid_this_gen.bodies['torso'].position.x - SCREEN_WIDTH / 3)
-
-        draw_options.transform = pymunk.Transform.translation(-camera_x, 0)
-        space.debug_draw(draw_options)
+        if humanoids:
+            best = int(np.argmax(state.fitness[rows]))
+            best_fitness_so_far = max(best_fitness_so_far, float(state.fitness[rows[best]]))
+        else:
+            running = False
 
-        death_wall_speed = 5
-        death_wall_x = spawn_pos[0] - 150 + ((pygame.time.get_ticks() - start_time) / 1000.0) * death_wall_speed
+        # death wall position comes from simulated time (steps taken)
+        death_wall_x = spawn_pos[0] - 150 + step * DEATH_WALL_SPEED
         wall_screen_x = death_wall_x
-        pygame.draw.line(screen, (255, 0, 0), (wall_screen_x, 0), (wall_screen_x, SCREEN_HEIGHT), 3)
-
-        # UI
-        best_genome_to_draw = None
-        best_fitness_in_gen = -float('inf')
-
-        if ge and humanoids:
-            best_idx = -1
-            for i in range(len(ge)):
-                if humanoids[i].is_alive and ge[i].fitness > best_fitness_in_gen:
-                    best_fitness_in_gen = ge[i].fitness
-                    best_idx = i
-            if best_idx != -1:
-                best_genome_to_draw = ge[best_idx]
-
-        if best_genome_to_draw:
-            nn_rect = pygame.Rect(SCREEN_WIDTH - 420, 20, 400, 350)
-            pygame.draw.rect(screen, (240, 240, 240), nn_rect)
-            pygame.draw.rect(screen, (0, 0, 0), nn_rect, 2)
-            draw_neural_network(screen, best_genome_to_draw, config, (nn_rect.x + 10, nn_rect.y + 10), nn_rect.width - 20, nn_rect.height - 20)
-
-        stats_y = 380
-        info_texts = [
-            f"Generation: {p.generation}",
-            f"Best Fitness Ever: {best_fitness_so_far:.1f}",
-            f"Current Best: {best_fitness_in_gen:.1f}",
-            f"Alive: {len(humanoids)} / {len(genomes)}"
-        ]
-        
-        for i, text in enumerate(info_texts):
-            text_surface = font.render(text, True, (0, 0, 0))
-            screen.blit(text_surface, (SCREEN_WIDTH - 200, stats_y + i * 25))
+        lap('bookkeeping')
 
-        pygame.display.flip()
-        clock.tick(60)
+        if not headless:
+            draw_frame(make_frame(state, rows, ge, len(genomes), config, wall_screen_x))
+            clock.tick(60)
+        elif renderer is not None:
+            if renderer.closed:
+                quit()
+            if renderer.wants_frame(step):
+                renderer.publish(make_frame(state, rows, ge, len(genomes), config, wall_screen_x))
+        lap('render')
 
     # Cleanup
-    for humanoid in humanoids:
-        humanoid.remove_from_space()
+    for humanoid, genome, row in zip(humanoids, ge, rows):
+        genome.fitness = float(state.fitness[row])
+        if not isolated:
+            humanoid.remove_from_space()
+    if isolated:
+        walker_pool.release(walkers)
+    lap('bookkeeping')
+    if profiler is not None:
+        profiler.stats['walkers'] += len(genomes)
+        profiler.stats['walker_steps'] += walker_steps
+
+    return walker_steps
+
+def eval_genome_chunk(genomes, config, isolated=True, early_stopping=None, trajectory_path=None, profile=False,
+                      seed=None, terrain_seed=None):
+    # runs inside a worker process, each worker gets its own space and ground
+    if early_stopping is not None:
+        early_stopping.reset_stats()
+    profiler = Profiler() if profile else None
+    recorder = None
+    if trajectory_path is not None:
+        # the file was created by the parent, every worker writes its own walkers into it
+        recorder = TrajectoryFile.open(trajectory_path, mode='r+').recorder([genome_id for genome_id, _ in genomes])
+    simulate(genomes, config, headless=True, isolated=isolated, early_stopping=early_stopping, seed=seed,
+             recorder=recorder, profiler=profiler, terrain=terrain_cache.get(terrain_seed))
+    if recorder is not None:
+        recorder.close()
+    fitness = [(genome_id, genome.fitness) for genome_id, genome in genomes]
+    return (fitness, early_stopping.stats if early_stopping is not None else None,
+            profiler.stats if profiler is not None else None)
+
+class ParallelEvaluator:
+    """
+    Like neat.ParallelEvaluator, but every worker simulates a whole chunk of
+    the population in its own space instead of one genome at a time.
+    """
+    def __init__(self, num_workers, isolated=True, early_stopping=None, profiler=None):
+        self.num_workers = num_workers
+        self.isolated = isolated
+        self.early_stopping = early_stopping
+        self.profiler = profiler
+        self.pool = multiprocessing.Pool(num_workers)
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def evaluate(self, genomes, config, seed=None):
+        global best_fitness_so_far
+
+        # strided split so that every worker gets about the same number of walkers
+        chunks = [genomes[i::self.num_workers] for i in range(self.num_workers)]
+        trajectory = create_generation_trajectory(genomes) if seed is None else None
+        trajectory_path = trajectory.path if trajectory else None
+        profile = self.profiler is not None
+        jobs = [self.pool.apply_async(eval_genome_chunk,
+                                      (chunk, config, self.isolated, self.early_stopping, trajectory_path, profile, seed,
+                                       episode_terrain_seed(seed)))
+                for chunk in chunks if chunk]
+
+        genome_by_id = dict(genomes)
+        for job in jobs:
+            results, early_stopping_stats, profiler_stats = job.get()
+            for genome_id, fitness in results:
+                genome_by_id[genome_id].fitness = fitness
+                best_fitness_so_far = max(best_fitness_so_far, fitness)
+            if early_stopping_stats is not None:
+                self.early_stopping.merge(early_stopping_stats)
+            if profiler_stats is not None:
+                self.profiler.merge(profiler_stats)
+
+def make_island_evaluator(isolated, early_stopping, terrain_seed, episodes, survival_threshold, cache_size, cache_salt):
+    # runs inside an island process, which simulates its whole population itself
+    global HEADLESS, ISOLATED, EARLY_STOPPING, RECORD_EVERY, RENDERER, PROFILER, TERRAIN_SEED
+    HEADLESS = True
+    ISOLATED = isolated
+    EARLY_STOPPING = EarlyStopping(dt=PHYSICS_STEPS) if early_stopping else None
+    RECORD_EVERY = 0
+    RENDERER = None
+    PROFILER = None
+    TERRAIN_SEED = terrain_seed
+    evaluate = eval_genomes
+    if episodes > 1:
+        evaluate = EpisodeRacing(episodes, keep_fraction=survival_threshold).wrap(evaluate)
+    return FitnessCache(cache_size, salt=cache_salt).wrap(evaluate)
+
+def draw_frame(frame):
+    """Draw a snapshot from make_frame(), the same way in lockstep and from the Renderer."""
+    import pygame
+
+    # camera follow
+    camera_x = 0
+    if frame['best'] is not None:
+        camera_x = max(0, frame['poses'][frame['best'], TORSO, 0] - SCREEN_WIDTH / 3)
+    # straight from the poses, so the ground is drawn once however many spaces the walkers are in
+    draw_poses(screen, frame['poses'], camera_x, SCREEN_HEIGHT - 100, frame['terrain'])
+
+    wall_x = frame['wall_x']
+    pygame.draw.line(screen, (255, 0, 0), (wall_x, 0), (wall_x, SCREEN_HEIGHT), 3)
+
+    draw_overlay(frame['best_genome'], frame['config'], frame['generation'], frame['best_fitness_ever'],
+                 frame['best_fitness'], len(frame['poses']), frame['genome_count'])
+    pygame.display.flip()
+
+def draw_overlay(best_genome, config, generation, best_fitness_ever, best_fitness_in_gen, alive, genome_count):
+    import pygame
+
+    if best_genome:
+        nn_rect = pygame.Rect(SCREEN_WIDTH - 420, 20, 400, 350)
+        draw_network_panel(screen, best_genome, config, nn_rect)
 
-def run(config_file):
+    stats_y = 380
+    info_texts = [
+        f"Generation: {generation}",
+        f"Best Fitness Ever: {best_fitness_ever:.1f}",
+        f"Current Best: {best_fitness_in_gen:.1f}",
+        f"Alive: {alive} / {genome_count}"
+    ]
+    
+    for i, text in enumerate(info_texts):
+        text_surface = get_font().render(text, True, (0, 0, 0))
+        screen.blit(text_surface, (SCREEN_WIDTH - 200, stats_y + i * 25))
+
+class Renderer:
+    """
+    Draws the walkers from state snapshots while the physics runs unthrottled.
+
+    simulate() publishes a snapshot every render_every steps, or whenever
+    1 / fps seconds of wall time have passed. The physics side only builds
+    the next frame and swaps it in under a lock, the renderer always draws
+    the latest published frame, so neither waits for the other. SDL wants
+    its window and events on the main thread (macOS allows nothing else), so
+    run_alongside() keeps them there and moves the evolution to a worker
+    thread instead. Closing the window ends the run.
+    """
+    def __init__(self, fps=30, render_every=None):
+        self.fps = fps
+        self.render_every = render_every
+        self.lock = threading.Lock()
+        self.frame = None
+        self.frame_version = 0
+        self.next_frame_time = 0.0
+        self.closed = False
+
+    def wants_frame(self, step):
+        if self.render_every:
+            return step % self.render_every == 0
+        now = time.perf_counter()
+        if now < self.next_frame_time:
+            return False
+        self.next_frame_time = now + 1.0 / self.fps
+        return True
+
+    def publish(self, frame):
+        # the physics side only swaps a reference, a frame is never changed once published
+        with self.lock:
+            self.frame = frame
+            self.frame_version += 1
+
+    def run_alongside(self, target, *args):
+        """Call target(*args) in a worker thread and draw until it returns, returns its result."""
+        import pygame
+
+        outcome = {}
+
+        def work():
+            try:
+                outcome['result'] = target(*args)
+            except Exception as e:
+                outcome['error'] = e
+
+        # a daemon, so closing the window doesn't wait for the episode to end
+        worker = threading.Thread(target=work, daemon=True)
+        worker.start()
+        drawn_version = 0
+        while worker.is_alive():
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    self.closed = True
+                    pygame.quit()
+                    quit()
+
+            with self.lock:
+                frame, version = self.frame, self.frame_version
+            if frame is not None and version != drawn_version:
+                self.draw(frame)
+                drawn_version = version
+            clock.tick(self.fps)
+        pygame.quit()
+        if 'error' in outcome:
+            raise outcome['error']
+        return outcome['result']
+
+    def draw(self, frame):
+        draw_frame(frame)
+
+def make_frame(state, rows, ge, genome_count, config, wall_x):
+    fitness = state.fitness[rows]
+    best = int(np.argmax(fitness)) if len(rows) else None
+    return {
+        'poses': state.data[rows, :, :3].copy(),
+        'best': best,
+        'best_genome': ge[best] if best is not None else None,
+        'best_fitness': float(fitness[best]) if best is not None else -float('inf'),
+        'best_fitness_ever': best_fitness_so_far,
+        'genome_count': genome_count,
+        'generation': p.generation,
+        'config': config,
+        'wall_x': wall_x,
+        'terrain': state.terrain,
+    }
+
+def load_config(config_file, recurrent=False):
     config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
                          neat.DefaultSpeciesSet, neat.DefaultStagnation,
                          config_file)
+    if recurrent:
+        # lets mutations add cycles and makes simulate() build recurrent networks
+        config.genome_config.feed_forward = False
+    return config
+
+def fitness_salt(config, isolated, episodes, terrain_seed):
+    """Salt of the fitness cache, everything besides the genome that changes a walker's score."""
+    # taken from the config and not from --recurrent, a resumed run keeps the setting of its checkpoint
+    network = 'feedforward' if config.genome_config.feed_forward else 'recurrent'
+    return (f"{EPISODE_STEPS}:{DEATH_WALL_SPEED!r}:batched:contact-handlers:{'isolated' if isolated else 'shared'}"
+            f":episodes{episodes}:terrain{terrain_seed}:{network}"
+            # stopped walkers keep a truncated score that depends on the rest of the population
+            f":early-stop{EARLY_STOPPING.describe() if EARLY_STOPPING is not None else None}")
+
+def run(config_file, headless=False, workers=1, seed=None, cache_size=10000, cache_file=None,
+        isolated=True, early_stopping=False, checkpoint_every=10, checkpoint_prefix=None,
+        resume=None, winner_file=None, record_every=0, record_prefix=None, render_fps=None,
+        render_every=None, profile_file=None, episodes=1, terrain_seed=None, recurrent=False, islands=1,
+        migration_interval=10, migrants=3, record_top=None):
+    global HEADLESS, ISOLATED, EARLY_STOPPING, RECORD_EVERY, RECORD_PREFIX, RECORD_TOP, RENDERER, PROFILER, TERRAIN_SEED
+    TERRAIN_SEED = terrain_seed
+    ISOLATED = isolated
+    RECORD_EVERY = record_every if record_prefix else 0
+    RECORD_PREFIX = record_prefix
+    RECORD_TOP = record_top
+    EARLY_STOPPING = EarlyStopping(dt=PHYSICS_STEPS) if early_stopping else None
+    PROFILER = Profiler(profile_file, workers) if profile_file else None
+    if seed is not None:
+        # the episode itself has no randomness, so this makes the whole run reproducible
+        random.seed(seed)
+    # worker and island processes never draw, so parallel runs are always headless
+    HEADLESS = headless or workers > 1 or islands > 1
+    if not HEADLESS:
+        init_display()
+    if not HEADLESS and (render_fps or render_every):
+        # physics runs unthrottled in a worker thread, the window is drawn from snapshots
+        RENDERER = Renderer(render_fps or 30, render_every)
+        HEADLESS = True
+
+    if islands > 1:
+        # every island evolves its own population in its own process, each with its own fitness cache
+        config = load_config(config_file, recurrent)
+        model = IslandModel(config, islands, migration_interval, migrants)
+        winner = model.run(make_island_evaluator,
+                           (isolated, early_stopping, terrain_seed, episodes,
+                            config.reproduction_config.survival_threshold, cache_size,
+                            fitness_salt(config, isolated, episodes, terrain_seed)),
+                           GENERATIONS)
+        if winner_file:
+            with open(winner_file, 'wb') as f:
+                pickle.dump(winner, f)
+        print('\nBest genome:\n{!s}'.format(winner))
+        return
 
     global p
-    p = neat.Population(config)
+    cache_state = None
+    if resume:
+        # config, population, species, RNG state and fitness cache all come from the checkpoint
+        p, cache_state = restore_checkpoint(resume)
+        print(f'Resuming from {resume} at generation {p.generation}')
+    else:
+        p = neat.Population(load_config(config_file, recurrent))
+
+    # elites come back unchanged every generation, no need to walk them again
+    cache = FitnessCache(cache_size, salt=fitness_salt(p.config, isolated, episodes, terrain_seed))
+    if cache_file:
+        cache.load(cache_file)
+    if cache_state is not None:
+        cache.set_state(cache_state)
 
     p.add_reporter(neat.StdOutReporter(True))
     stats = neat.StatisticsReporter()
     p.add_reporter(stats)
+    if EARLY_STOPPING is not None:
+        p.add_reporter(EarlyStoppingReporter(EARLY_STOPPING))
+    if PROFILER is not None:
+        p.add_reporter(PROFILER)
+    if RECORD_EVERY and RECORD_TOP:
+        p.add_reporter(TopWalkerRecorder(RECORD_EVERY, RECORD_PREFIX, RECORD_TOP))
+    checkpointer = None
+    if checkpoint_every and checkpoint_prefix:
+        checkpointer = AsyncCheckpointer(checkpoint_every, checkpoint_prefix, cache, p.reproduction)
+        p.add_reporter(checkpointer)
+
+    evaluator = None
+    if workers > 1:
+        evaluator = ParallelEvaluator(workers, isolated=isolated, early_stopping=EARLY_STOPPING, profiler=PROFILER)
+        evaluate = evaluator.evaluate
+    else:
+        evaluate = eval_genomes
+
+    if episodes > 1:
+        # extra seeded episodes only for genomes close to the survival cut of the reproduction
+        racing = EpisodeRacing(episodes, keep_fraction=p.config.reproduction_config.survival_threshold)
+        p.add_reporter(EpisodeRacingReporter(racing))
+        evaluate = racing.wrap(evaluate)
 
-    winner = p.run(eval_genomes, 1000)
+    if RENDERER is not None:
+        winner = RENDERER.run_alongside(p.run, cache.wrap(evaluate), max(0, GENERATIONS - p.generation))
+    else:
+        winner = p.run(cache.wrap(evaluate), max(0, GENERATIONS - p.generation))
+
+    if evaluator is not None:
+        evaluator.close()
+    if checkpointer is not None:
+        checkpointer.wait()
+    if cache_file:
+        cache.save(cache_file)
+    if winner_file:
+        with open(winner_file, 'wb') as f:
+            pickle.dump(winner, f)
 
     print('\nBest genome:\n{!s}'.format(winner))
+    print(f'Fitness cache: {cache.hits} hits, {cache.misses} misses')
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='NEAT Humanoid Walker')
+    parser.add_argument('--headless', action='store_true', help='Run without a window and without the 60 FPS cap')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes for evaluation (implies --headless)')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed for a reproducible run')
+    parser.add_argument('--cache-size', type=int, default=10000, help='Max genomes kept in the fitness cache (0 disables it)')
+    parser.add_argument('--cache-file', default=None, help='Load and save the fitness cache from this file')
+    parser.add_argument('--shared-space', action='store_true', help='Put all walkers into one physics space instead of one space each')
+    parser.add_argument('--early-stop', action='store_true', help='Stop hopeless walkers before the episode ends')
+    parser.add_argument('--checkpoint-every', type=int, default=10, help='Save a checkpoint every N generations (0 disables)')
+    parser.add_argument('--checkpoint-prefix', default=None, help='Checkpoint file prefix (default: checkpoints/walker- next to this script)')
+    parser.add_argument('--resume', default=None, help='Resume from a checkpoint file')
+    parser.add_argument('--save-winner', default=None, help='Pickle the winning genome to this file')
+    parser.add_argument('--record-every', type=int, default=0, help='Record all walkers every N generations (0 disables)')
+    parser.add_argument('--record-top', type=int, default=None, help='Record only the best K walkers of a recorded generation, they walk again after the evaluation')
+    parser.add_argument('--record-prefix', default=None, help='Trajectory file prefix (default: trajectories/gen- next to this script)')
+    parser.add_argument('--render-fps', type=int, default=None, help='Run the physics unthrottled in a worker thread and draw snapshots of it at this FPS')
+    parser.add_argument('--render-every', type=int, default=None, help='Like --render-fps, but show every Nth physics step')
+    parser.add_argument('--profile', default=None, help='Write per generation timings to this file (.csv for CSV, JSON lines otherwise)')
+    parser.add_argument('--recurrent', action='store_true', help='Evolve recurrent controllers (a resumed run keeps the setting of its checkpoint)')
+    parser.add_argument('--terrain', type=int, default=None, help='Walk on generated terrain from this seed instead of flat ground')
+    parser.add_argument('--episodes', type=int, default=1, help='Up to this many episodes per genome, extra ones only for genomes near the selection threshold')
+    parser.add_argument('--islands', type=int, default=1, help='Evolve this many populations in their own processes (implies --headless, no checkpoints)')
+    parser.add_argument('--migration-interval', type=int, default=10, help='Generations between two migrations of --islands')
+    parser.add_argument('--migrants', type=int, default=3, help='Best genomes every island sends to the next one per migration')
+    args = parser.parse_args()
+    if args.islands > 1 and (args.resume or args.workers > 1):
+        parser.error('--islands runs one process per island and cannot be combined with --resume or --workers')
+
     local_dir = os.path.dirname(__file__)
     config_path = os.path.join(local_dir, 'config-feedforward.txt')
-    run(config_path)
\ No newline at end of file
+    checkpoint_prefix = args.checkpoint_prefix or os.path.join(local_dir, 'checkpoints', 'walker-')
+    record_prefix = args.record_prefix or os.path.join(local_dir, 'trajectories', 'gen-')
+    run(config_path, headless=args.headless, workers=args.workers, seed=args.seed,
+        cache_size=args.cache_size, cache_file=args.cache_file, isolated=not args.shared_space,
+        early_stopping=args.early_stop, checkpoint_every=args.checkpoint_every,
+        checkpoint_prefix=checkpoint_prefix, resume=args.resume, winner_file=args.save_winner,
+        record_every=args.record_every, record_prefix=record_prefix, render_fps=args.render_fps,
+        render_every=args.render_every, profile_file=args.profile, episodes=args.episodes,
+        terrain_seed=args.terrain, recurrent=args.recurrent, islands=args.islands,
+        migration_interval=args.migration_interval, migrants=args.migrants, record_top=args.record_top)
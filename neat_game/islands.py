@@ -0,0 +1,236 @@
+"""
+Island model: several NEAT populations evolving side by side in their own processes.
+
+Every island is a full neat.Population from the same config, with its own
+species set and RNG seed, evaluated serially inside its process. Every
+`interval` generations each island sends copies of its best genomes to the
+next island on a ring and replaces its own worst genomes with the ones it
+receives. Apart from that the islands only report a short summary of every
+generation to the parent, which combines them into one line per generation.
+"""
+import copy
+import itertools
+import multiprocessing
+import queue
+import random
+import time
+
+import neat
+import numpy as np
+
+
+class Migration:
+    """
+    Ring migration of one island, wraps the island's eval function.
+
+    Migrants leave right after a generation is evaluated, keep the fitness they
+    got at home and take part in the selection of the generation they arrive
+    in. Sending never blocks, receiving waits until the neighbour has reached
+    the same generation, which costs little as all islands run at about the
+    same pace and keeps seeded runs reproducible. A neighbour that stopped
+    sends None and isn't waited for any more.
+    """
+    def __init__(self, inbox, outbox, interval=10, count=3):
+        self.inbox = inbox
+        self.outbox = outbox
+        self.interval = interval
+        self.count = count
+        self.neighbour_done = False
+
+    def wrap(self, evaluate, population):
+        def migrating_evaluate(genomes, config):
+            evaluate(genomes, config)
+            if population.generation and population.generation % self.interval == 0:
+                self.exchange(population, genomes)
+        return migrating_evaluate
+
+    def exchange(self, population, genomes):
+        ranked = sorted(genomes, key=lambda item: item[1].fitness, reverse=True)
+        self.outbox.put([copy.deepcopy(genome) for _, genome in ranked[:self.count]])
+        if self.neighbour_done:
+            return
+        migrants = self.inbox.get()
+        if migrants is None:
+            self.neighbour_done = True
+            return
+        # the worst genomes make room, the ones that were just sent away stay
+        for (genome_id, _), migrant in zip(reversed(ranked[self.count:]), migrants):
+            self.replace(population, genome_id, migrant)
+
+    @staticmethod
+    def replace(population, genome_id, migrant):
+        """Put migrant in the place of genome_id, in the population and in its species."""
+        migrant.key = next(population.reproduction.genome_indexer)
+        # the migrant's hidden nodes were numbered by its home island, new nodes here must not reuse them
+        genome_config = population.config.genome_config
+        next_node = next(genome_config.node_indexer) if genome_config.node_indexer is not None else 0
+        genome_config.node_indexer = itertools.count(max(next_node, max(migrant.nodes) + 1))
+        del population.population[genome_id]
+        population.population[migrant.key] = migrant
+
+        # the next speciation moves it to the species it really belongs to
+        species_set = population.species
+        species_id = species_set.genome_to_species.pop(genome_id)
+        members = species_set.species[species_id].members
+        del members[genome_id]
+        members[migrant.key] = migrant
+        species_set.genome_to_species[migrant.key] = species_id
+
+    def close(self):
+        self.outbox.put(None)
+
+
+class IslandStatus(neat.reporting.BaseReporter):
+    """Sends a summary of every evaluated generation of an island to the parent."""
+    def __init__(self, island, status):
+        self.island = island
+        self.status = status
+        self.start = None
+
+    def start_generation(self, generation):
+        self.generation = generation
+        self.start = time.perf_counter()
+
+    def post_evaluate(self, config, population, species, best_genome):
+        fitness = [genome.fitness for genome in population.values()]
+        self.status.put(('generation', self.island, self.generation, {
+            'best': best_genome.fitness,
+            'mean': float(np.mean(fitness)),
+            'species': len(species.species),
+            'seconds': time.perf_counter() - self.start,
+        }))
+
+
+def run_island(island, config, seed, generations, make_evaluate, evaluate_args, inbox, outbox, status, stop,
+               interval, count):
+    # runs inside the island's process
+    random.seed(seed)
+    population = neat.Population(config)
+    population.add_reporter(IslandStatus(island, status))
+    migration = Migration(inbox, outbox, interval, count)
+    evaluate = migration.wrap(make_evaluate(*evaluate_args), population)
+    try:
+        while population.generation < generations and not stop.is_set():
+            generation = population.generation
+            population.run(evaluate, 1)
+            if population.generation == generation:
+                # reached the fitness threshold, the other islands can stop too
+                stop.set()
+                break
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        migration.close()
+    status.put(('done', island, population.best_genome))
+
+
+class IslandReporter:
+    """Combines the summaries of all islands into one line per generation."""
+    def __init__(self, islands):
+        self.islands = islands
+        self.pending = {}
+        self.last_generation = {}
+        # island -> last generation it reported, for the islands that stopped
+        self.finished = {}
+        self.best_fitness = None
+
+    def island_generation(self, island, generation, summary):
+        self.last_generation[island] = generation
+        self.pending.setdefault(generation, {})[island] = summary
+        self.flush()
+
+    def island_done(self, island):
+        self.finished[island] = self.last_generation.get(island, -1)
+        print(f"Island {island} stopped after {self.finished[island] + 1} generations")
+        self.flush()
+
+    def flush(self):
+        # a generation is printed once every island that gets that far has reported it
+        for generation in sorted(self.pending):
+            summaries = self.pending[generation]
+            expected = self.islands - sum(1 for last in self.finished.values() if last < generation)
+            if len(summaries) < expected:
+                break
+            del self.pending[generation]
+            self.report(generation, summaries)
+
+    def report(self, generation, summaries):
+        best_island = max(summaries, key=lambda island: summaries[island]['best'])
+        best = summaries[best_island]['best']
+        if self.best_fitness is None or best > self.best_fitness:
+            self.best_fitness = best
+        mean = np.mean([summary['mean'] for summary in summaries.values()])
+        species = '+'.join(str(summaries[island]['species']) for island in sorted(summaries))
+        seconds = max(summary['seconds'] for summary in summaries.values())
+        print(f"Generation {generation}: best {best:.3f} (island {best_island}), mean {mean:.3f}, "
+              f"species {species}, best ever {self.best_fitness:.3f}, {seconds:.2f} s")
+
+
+class IslandModel:
+    """
+    Evolves `islands` populations from config in their own processes.
+
+    make_evaluate(*evaluate_args) is called inside every island process and
+    returns its eval function, so both have to be picklable.
+    """
+    def __init__(self, config, islands=4, interval=10, count=3):
+        self.config = config
+        self.islands = islands
+        self.interval = interval
+        self.count = count
+
+    def run(self, make_evaluate, evaluate_args, generations, reporter=None):
+        """Run until every island has stopped and return the best genome of all of them."""
+        reporter = reporter or IslandReporter(self.islands)
+        # drawn from the parent's RNG, so a seeded run seeds every island the same way again
+        seeds = [random.randrange(2 ** 32) for _ in range(self.islands)]
+        inboxes = [multiprocessing.Queue() for _ in range(self.islands)]
+        status = multiprocessing.Queue()
+        stop = multiprocessing.Event()
+        processes = [multiprocessing.Process(target=run_island,
+                                             args=(island, self.config, seeds[island], generations, make_evaluate,
+                                                   evaluate_args, inboxes[island],
+                                                   inboxes[(island + 1) % self.islands], status, stop,
+                                                   self.interval, self.count))
+                     for island in range(self.islands)]
+        for process in processes:
+            process.start()
+
+        winner = None
+        running = set(range(self.islands))
+        try:
+            while running:
+                try:
+                    message = status.get(timeout=1.0)
+                except queue.Empty:
+                    crashed = [island for island in running if not processes[island].is_alive()]
+                    if crashed and status.empty():
+                        raise RuntimeError(f"island {crashed[0]} exited without finishing")
+                    continue
+                kind, island, *rest = message
+                if kind == 'generation':
+                    reporter.island_generation(island, *rest)
+                else:
+                    genome, = rest
+                    running.discard(island)
+                    if genome is not None and (winner is None or genome.fitness > winner.fitness):
+                        winner = genome
+                    reporter.island_done(island)
+        except BaseException:
+            for process in processes:
+                process.terminate()
+            raise
+        finally:
+            # migrants nobody picked up would keep the islands from exiting
+            while any(process.is_alive() for process in processes):
+                for inbox in inboxes:
+                    try:
+                        while True:
+                            inbox.get_nowait()
+                    except queue.Empty:
+                        pass
+                time.sleep(0.05)
+            for process in processes:
+                process.join()
+        return winner
@@ -0,0 +1,103 @@
+import math
+
+import neat
+import numpy as np
+
+
+class EpisodeRacing:
+    """
+    Evaluates genomes on up to max_episodes episodes, but only spends the extra
+    episodes where they can still change the selection.
+
+    Every genome walks the plain episode first. Each following round gives one
+    more episode (the same seeded push for every genome of the round, see
+    game_neat.perturb()) to the genomes whose mean fitness is still too close
+    to the selection threshold to tell which side of it they are on. The
+    threshold is the fitness that keep_fraction of the genomes beat, "too close"
+    is within z standard errors, with the episode noise pooled over every
+    genome that already has more than one episode. Until there is such an
+    estimate the halve_fraction of the candidates closest to the threshold go
+    on, as in successive halving. A genome's fitness is the mean over its
+    episodes.
+
+    Like early stopping this makes the number of episodes a genome gets depend
+    on the rest of the population.
+    """
+    def __init__(self, max_episodes=5, keep_fraction=0.3, z=1.0, halve_fraction=0.5):
+        self.max_episodes = max_episodes
+        self.keep_fraction = keep_fraction
+        self.z = z
+        self.halve_fraction = halve_fraction
+        self.stats = {'genomes': 0, 'episodes': 0}
+
+    @staticmethod
+    def episode_seed(episode):
+        # the first episode is the plain training episode
+        return None if episode == 0 else episode
+
+    def wrap(self, evaluate):
+        """
+        Return an eval function for neat that runs the episodes through
+        evaluate(genomes, config, seed=None), which sets the fitness of one
+        episode on every genome.
+        """
+        def racing_evaluate(genomes, config):
+            scores = [[] for _ in genomes]
+            candidates = list(range(len(genomes)))
+            for episode in range(self.max_episodes):
+                if not candidates:
+                    break
+                evaluate([genomes[i] for i in candidates], config, seed=self.episode_seed(episode))
+                for i in candidates:
+                    scores[i].append(genomes[i][1].fitness)
+                self.stats['episodes'] += len(candidates)
+                candidates = self.undecided(scores, candidates)
+
+            for (genome_id, genome), genome_scores in zip(genomes, scores):
+                genome.fitness = float(np.mean(genome_scores))
+            self.stats['genomes'] += len(genomes)
+        return racing_evaluate
+
+    def undecided(self, scores, candidates):
+        """The candidates that get another episode."""
+        means = np.array([np.mean(genome_scores) for genome_scores in scores])
+        threshold = np.quantile(means, 1.0 - self.keep_fraction)
+        candidates = np.array(candidates)
+        distance = np.abs(means[candidates] - threshold)
+
+        sigma = self.noise(scores)
+        if sigma is None:
+            count = math.ceil(self.halve_fraction * len(candidates))
+            return candidates[np.argsort(distance, kind='stable')[:count]].tolist()
+        counts = np.array([len(scores[i]) for i in candidates])
+        return candidates[distance < self.z * sigma / np.sqrt(counts)].tolist()
+
+    @staticmethod
+    def noise(scores):
+        """Pooled standard deviation of a genome's fitness between episodes, None without any repeats."""
+        squares = 0.0
+        degrees = 0
+        for genome_scores in scores:
+            if len(genome_scores) > 1:
+                squares += float(np.sum((np.array(genome_scores) - np.mean(genome_scores)) ** 2))
+                degrees += len(genome_scores) - 1
+        if not degrees:
+            return None
+        return math.sqrt(squares / degrees)
+
+    def reset_stats(self):
+        self.stats = {'genomes': 0, 'episodes': 0}
+
+
+class EpisodeRacingReporter(neat.reporting.BaseReporter):
+    """Prints how many episodes the last generation needed compared to a flat max_episodes each."""
+    def __init__(self, racing):
+        self.racing = racing
+
+    def post_evaluate(self, config, population, species, best_genome):
+        stats = self.racing.stats
+        if stats['genomes']:
+            flat = stats['genomes'] * self.racing.max_episodes
+            print(f"Multi-episode evaluation: {stats['episodes']} episodes for {stats['genomes']} genomes "
+                  f"({stats['episodes'] / stats['genomes']:.2f} each, {flat} with {self.racing.max_episodes} each)")
+        self.racing.reset_stats()
@@ -0,0 +1,135 @@
+"""
+Replay saved genomes (like winner.pkl) headless and benchmark them.
+
+Every genome walks the plain training episode plus a number of seeded episodes
+with a random initial push, spread over worker processes. Prints the fitness
+distribution of every genome and the simulation throughput, and can save the
+plain episode's body poses as a trajectory file (see trajectory.py). With
+--terrain every episode walks on its own generated terrain (see terrain.py).
+
+    python replay.py winner.pkl other.pkl --seeds 16 --workers 4
+    python replay.py winner.pkl --seeds 16 --terrain 100
+"""
+import argparse
+import multiprocessing
+import os
+import pickle
+import time
+
+import neat
+import numpy as np
+
+import game_neat
+from trajectory import TrajectoryFile
+
+
+def load_genomes(paths):
+    genomes = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            genome = pickle.load(f)
+        genomes.append((os.path.basename(path), genome))
+    return genomes
+
+
+def check_compatible(label, genome, config):
+    genome_config = config.genome_config
+    missing_outputs = [key for key in genome_config.output_keys if key not in genome.nodes]
+    unknown_inputs = sorted({inode for inode, _ in genome.connections
+                             if inode < 0 and inode not in genome_config.input_keys})
+    if missing_outputs or unknown_inputs:
+        raise ValueError(f"{label} does not match the config ({genome_config.num_inputs} inputs, "
+                         f"{genome_config.num_outputs} outputs): missing outputs {missing_outputs}, "
+                         f"unknown inputs {unknown_inputs}")
+
+
+def run_episode(genomes, config, seed, trajectory_path=None, terrain_seed=None):
+    recorder = None
+    if trajectory_path is not None:
+        # walkers are recorded under their position in the genome list
+        recorder = TrajectoryFile.open(trajectory_path, mode='r+').recorder(range(len(genomes)))
+    terrain = game_neat.terrain_cache.get(terrain_seed)
+    walker_steps = game_neat.simulate(list(enumerate(genomes)), config, headless=True, seed=seed, recorder=recorder,
+                                      terrain=terrain)
+    if recorder is not None:
+        recorder.close()
+    return [genome.fitness for genome in genomes], walker_steps
+
+
+def _run_episode(args):
+    return run_episode(*args)
+
+
+def replay(genomes, config, seeds, workers=1, trajectory_path=None, terrain_seed=None):
+    """
+    Run the plain episode and one episode per seed for all genomes.
+
+    Returns the fitness array of shape (episodes, genomes) with the plain
+    episode first and the number of walker steps simulated. With a
+    trajectory_path the plain episode is recorded into that file. With a
+    terrain_seed the plain episode walks on that terrain and the episode of
+    seed s on terrain terrain_seed + s, like in training.
+    """
+    def episode_terrain(seed):
+        return None if terrain_seed is None else terrain_seed + (seed or 0)
+    if trajectory_path is not None:
+        TrajectoryFile.create(trajectory_path, range(len(genomes)), game_neat.EPISODE_STEPS, game_neat.PHYSICS_STEPS,
+                              terrain_seed=episode_terrain(None))
+    jobs = [(genomes, config, None, trajectory_path, episode_terrain(None))]
+    jobs += [(genomes, config, seed, None, episode_terrain(seed)) for seed in seeds]
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            results = pool.map(_run_episode, jobs)
+    else:
+        results = [_run_episode(job) for job in jobs]
+
+    fitness = np.array([episode_fitness for episode_fitness, _ in results])
+    walker_steps = sum(steps for _, steps in results)
+    return fitness, walker_steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay and benchmark saved NEAT walker genomes')
+    parser.add_argument('genomes', nargs='+', help='Pickled genome files')
+    parser.add_argument('--config', default=os.path.join(os.path.dirname(__file__), 'config-feedforward.txt'))
+    parser.add_argument('--seeds', type=int, default=8, help='Number of seeded episodes besides the plain one')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes')
+    parser.add_argument('--trajectory', default=None, help='Record the plain episode into this trajectory file')
+    parser.add_argument('--recurrent', action='store_true', help='The genomes come from a run with --recurrent')
+    parser.add_argument('--terrain', type=int, default=None, help='Walk on generated terrains starting from this seed')
+    args = parser.parse_args()
+
+    config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                         neat.DefaultSpeciesSet, neat.DefaultStagnation,
+                         args.config)
+    if args.recurrent:
+        config.genome_config.feed_forward = False
+    if config.genome_config.num_inputs != len(game_neat.SENSOR_PIPELINE):
+        parser.error(f"{args.config} has {config.genome_config.num_inputs} inputs, "
+                     f"the walkers have {len(game_neat.SENSOR_PIPELINE)} sensors")
+    labelled = load_genomes(args.genomes)
+    for label, genome in labelled:
+        try:
+            check_compatible(label, genome, config)
+        except ValueError as e:
+            parser.error(str(e))
+    genomes = [genome for _, genome in labelled]
+
+    start = time.perf_counter()
+    fitness, walker_steps = replay(genomes, config, range(args.seeds), args.workers, args.trajectory, args.terrain)
+    elapsed = time.perf_counter() - start
+
+    print(f"{'genome':<24} {'plain':>9} {'mean':>9} {'std':>9} {'min':>9} {'median':>9} {'max':>9}")
+    for i, (label, _) in enumerate(labelled):
+        seeded = fitness[1:, i] if len(fitness) > 1 else fitness[:, i]
+        print(f"{label:<24} {fitness[0, i]:9.2f} {seeded.mean():9.2f} {seeded.std():9.2f} "
+              f"{seeded.min():9.2f} {np.median(seeded):9.2f} {seeded.max():9.2f}")
+    print(f"{len(fitness)} episodes, {walker_steps} walker steps in {elapsed:.2f} s "
+          f"({walker_steps / elapsed:.0f} simulated steps/s)")
+
+    if args.trajectory is not None:
+        print(f"Saved trajectory to {args.trajectory}")
+
+
+if __name__ == '__main__':
+    main()
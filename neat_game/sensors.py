@@ -0,0 +1,100 @@
+"""
+Declarative network inputs of the walkers.
+
+A sensor table is a list of Sensor rows, one per network input, in input
+order. compile_sensors() turns it into index and scale arrays once, after
+that every step computes all inputs of all walkers with a handful of
+vectorized operations, however many sensors there are.
+
+Sensor kinds:
+    value     field of body, minus the same field of relative_to if given
+    contact   1.0 while body touches the ground, else 0.0 (from the collision handlers)
+    height    height of body above the ground, relative to the spawn height
+    distance  x of body relative to where the walker spawned
+    wall      x of body relative to the death wall (0.0 when there is none)
+Every kind except contact is divided by scale.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+FIELDS = ('x', 'y', 'angle', 'vx', 'vy', 'angular_velocity')
+PX, PY = FIELDS.index('x'), FIELDS.index('y')
+KINDS = ('value', 'contact', 'height', 'distance', 'wall')
+
+Sensor = namedtuple('Sensor', ['name', 'body', 'field', 'relative_to', 'scale', 'kind'],
+                    defaults=('x', None, 1.0, 'value'))
+
+
+class SensorGroup:
+    """The sensors of one kind: their input columns, bodies, fields, reference bodies and scales."""
+    def __init__(self, sensors, columns, body_names):
+        self.columns = np.array(columns, dtype=np.intp)
+        self.bodies = np.array([body_names.index(sensor.body) for sensor in sensors], dtype=np.intp)
+        self.fields = np.array([FIELDS.index(sensor.field) for sensor in sensors], dtype=np.intp)
+        self.relative_to = np.array([body_names.index(sensor.relative_to) for sensor in sensors], dtype=np.intp)
+        self.scales = np.array([sensor.scale for sensor in sensors], dtype=np.float64)
+
+
+class CompiledSensors:
+    def __init__(self, sensors, groups):
+        self.sensors = sensors
+        self.names = [sensor.name for sensor in sensors]
+        self.groups = groups
+
+    def __len__(self):
+        return len(self.sensors)
+
+    def compute(self, state, rows, wall_x=None):
+        """Inputs of the given rows of a game_neat.PopulationState, shape (rows, sensors)."""
+        data = state.data[rows]
+        inputs = np.empty((len(rows), len(self.sensors)))
+        ground = state.terrain.height_at
+
+        group = self.groups.get('value')
+        if group is not None:
+            inputs[:, group.columns] = data[:, group.bodies, group.fields] / group.scales
+        group = self.groups.get('relative')
+        if group is not None:
+            inputs[:, group.columns] = ((data[:, group.bodies, group.fields] - data[:, group.relative_to, group.fields])
+                                        / group.scales)
+        group = self.groups.get('contact')
+        if group is not None:
+            inputs[:, group.columns] = state.contacts[rows][:, group.bodies]
+        group = self.groups.get('height')
+        if group is not None:
+            start_y = ground(data[:, group.bodies, PX]) - state.spawn_height[rows, None]
+            inputs[:, group.columns] = (data[:, group.bodies, PY] - start_y) / group.scales
+        group = self.groups.get('distance')
+        if group is not None:
+            inputs[:, group.columns] = (data[:, group.bodies, PX] - state.initial_pos[rows, 0, None]) / group.scales
+        group = self.groups.get('wall')
+        if group is not None:
+            if wall_x is None:
+                inputs[:, group.columns] = 0.0
+            else:
+                inputs[:, group.columns] = (data[:, group.bodies, PX] - wall_x) / group.scales
+        return inputs
+
+
+def compile_sensors(sensors, body_names):
+    """Group a sensor table by kind into a CompiledSensors, checking every row on the way."""
+    by_kind = {}
+    for column, sensor in enumerate(sensors):
+        if sensor.kind not in KINDS:
+            raise ValueError(f"sensor {sensor.name!r} has unknown kind {sensor.kind!r}")
+        if sensor.field not in FIELDS:
+            raise ValueError(f"sensor {sensor.name!r} has unknown field {sensor.field!r}")
+        for body in (sensor.body, sensor.relative_to):
+            if body is not None and body not in body_names:
+                raise ValueError(f"sensor {sensor.name!r} refers to unknown body {body!r}")
+        # values with and without a reference body are computed separately
+        kind = 'relative' if sensor.kind == 'value' and sensor.relative_to is not None else sensor.kind
+        by_kind.setdefault(kind, []).append((column, sensor))
+
+    groups = {}
+    for kind, entries in by_kind.items():
+        columns = [column for column, _ in entries]
+        group_sensors = [sensor._replace(relative_to=sensor.relative_to or sensor.body) for _, sensor in entries]
+        groups[kind] = SensorGroup(group_sensors, columns, body_names)
+    return CompiledSensors(list(sensors), groups)
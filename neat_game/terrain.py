@@ -0,0 +1,111 @@
+"""
+Procedural terrain: slopes, steps and rough ground generated from a seed.
+
+A terrain is only geometry, a polyline of ground points with the start area
+around the spawn point kept flat. Turning it into pymunk shapes is up to the
+space that uses it (see game_neat.create_ground()), generated terrains are
+kept in a TerrainCache so every seed is generated once per process.
+"""
+import math
+import random
+from collections import OrderedDict
+
+import numpy as np
+
+# world y of the flat ground line (SCREEN_HEIGHT - 100 in game_neat)
+GROUND_Y = 900
+START_X = -2000
+END_X = 20000
+
+# the terrain never leaves this band, higher would run off the top of the screen
+MIN_Y = GROUND_Y - 300
+MAX_Y = GROUND_Y + 60
+
+
+class Terrain:
+    def __init__(self, key, points):
+        self.key = key
+        self.points = np.asarray(points, dtype=np.float64)
+        self.xs = self.points[:, 0]
+        self.ys = self.points[:, 1]
+
+    def __len__(self):
+        return len(self.points) - 1
+
+    def height_at(self, x):
+        """Ground y (of the segment centre line) below x, works on arrays."""
+        return np.interp(x, self.xs, self.ys)
+
+    def segments(self):
+        return list(zip(map(tuple, self.points[:-1].tolist()), map(tuple, self.points[1:].tolist())))
+
+
+# the original world, one segment from START_X to END_X
+FLAT = Terrain('flat', [(START_X, GROUND_Y), (END_X, GROUND_Y)])
+
+
+def simplify(points, tolerance=1e-6):
+    """Merge runs of collinear points into single segments."""
+    merged = [points[0]]
+    for point, following in zip(points[1:-1], points[2:]):
+        (x0, y0), (x1, y1), (x2, y2) = merged[-1], point, following
+        if abs((x1 - x0) * (y2 - y0) - (y1 - y0) * (x2 - x0)) > tolerance * max(1.0, x2 - x0):
+            merged.append(point)
+    merged.append(points[-1])
+    return merged
+
+
+def generate(seed, flat_until=600, length=END_X, roughness=1.0):
+    """
+    A course of flat stretches, slopes, steps and rough patches.
+
+    Everything left of flat_until is flat at GROUND_Y so walkers spawn the same
+    way on every terrain, roughness scales the slopes, step heights and bumps.
+    """
+    rng = random.Random(seed)
+    points = [(START_X, GROUND_Y), (flat_until, GROUND_Y)]
+    x, y = float(flat_until), float(GROUND_Y)
+
+    def add(dx, dy):
+        nonlocal x, y
+        x += dx
+        y = min(MAX_Y, max(MIN_Y, y + dy))
+        points.append((x, y))
+
+    while x < length:
+        kind = rng.choice(('flat', 'slope', 'step', 'rough'))
+        if kind == 'flat':
+            add(rng.uniform(150, 400), 0.0)
+        elif kind == 'slope':
+            run = rng.uniform(200, 500)
+            add(run, run * math.tan(math.radians(rng.uniform(-12, 12) * roughness)))
+        elif kind == 'step':
+            # a short steep ramp instead of a vertical wall, then a landing
+            add(6.0, rng.choice((-1, 1)) * rng.uniform(6, 20) * roughness)
+            add(rng.uniform(80, 200), 0.0)
+        else:
+            for _ in range(rng.randint(4, 10)):
+                add(rng.uniform(20, 45), rng.uniform(-6, 6) * roughness)
+            add(rng.uniform(40, 80), 0.0)
+
+    return Terrain(seed, simplify(points))
+
+
+class TerrainCache:
+    """Generated terrains by seed, None is the flat ground. Bounded LRU like the fitness cache."""
+    def __init__(self, maxsize=32, **generate_args):
+        self.maxsize = maxsize
+        self.generate_args = generate_args
+        self.terrains = OrderedDict()
+
+    def get(self, seed):
+        if seed is None:
+            return FLAT
+        terrain = self.terrains.get(seed)
+        if terrain is None:
+            terrain = generate(seed, **self.generate_args)
+            self.terrains[seed] = terrain
+            while len(self.terrains) > self.maxsize:
+                self.terrains.popitem(last=False)
+        self.terrains.move_to_end(seed)
+        return terrain
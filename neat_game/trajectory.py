@@ -0,0 +1,247 @@
+"""
+Memory mapped walker trajectories and an offline viewer for them.
+
+A trajectory file is a fixed 64 byte header (with the seed of the terrain
+the walkers walked on, if any), the genome key of every recorded
+walker (int64) and then float32 poses laid out as [step][walker][body][x, y, angle],
+NaN where a walker wasn't simulated (dead, stopped early or taken from the
+fitness cache). Several worker processes can write disjoint walkers into the
+same file at once.
+
+    python trajectory.py view trajectories/gen-10.traj --speed 4
+    python trajectory.py gif trajectories/gen-10.traj walk.gif --every 3
+"""
+import argparse
+import math
+import os
+
+import numpy as np
+
+from terrain import FLAT, generate
+
+MAGIC = b'EMOTRAJ1'
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('walkers', '<u4'), ('bodies', '<u4'), ('steps', '<u4'),
+                         ('fields', '<u4'), ('generation', '<i4'), ('dt', '<f8'),
+                         ('terrain_seed', '<i8'), ('has_terrain', 'u1'), ('reserved', 'V19')])
+assert HEADER_DTYPE.itemsize == 64
+
+# same order as game_neat.BODY_NAMES
+BODY_NAMES = ('torso', 'head',
+              'upper_leg_0', 'lower_leg_0', 'foot_0',
+              'upper_leg_1', 'lower_leg_1', 'foot_1')
+
+# world y of the ground line (SCREEN_HEIGHT - 100 in game_neat)
+GROUND_Y = 900
+
+# sizes and colours as in Humanoid.create_body(), a single number is a circle radius
+BODY_SHAPES = {
+    'torso': ((20, 80), (0, 0, 255)),
+    'head': (20, (255, 0, 0)),
+    'upper_leg_0': ((12, 50), (0, 255, 0)),
+    'lower_leg_0': ((10, 40), (0, 200, 50)),
+    'foot_0': ((25, 8), (100, 100, 100)),
+    'upper_leg_1': ((12, 50), (0, 255, 0)),
+    'lower_leg_1': ((10, 40), (0, 200, 50)),
+    'foot_1': ((25, 8), (100, 100, 100)),
+}
+
+
+class TrajectoryFile:
+    def __init__(self, path, header, genome_keys, poses):
+        self.path = path
+        self.header = header
+        self.genome_keys = genome_keys
+        self.poses = poses
+
+    @staticmethod
+    def create(path, genome_keys, steps, dt, generation=-1, terrain_seed=None):
+        """
+        Create a file for len(genome_keys) walkers and steps + 1 poses each (the
+        start pose included), walking on the terrain of terrain_seed (None is flat).
+        """
+        header = np.zeros((), dtype=HEADER_DTYPE)
+        header['magic'] = MAGIC
+        header['walkers'] = len(genome_keys)
+        header['bodies'] = len(BODY_NAMES)
+        header['steps'] = steps
+        header['fields'] = 3
+        header['generation'] = generation
+        header['dt'] = dt
+        # files from before the terrain seed was saved have zeros here, so they show flat ground
+        if terrain_seed is not None:
+            header['terrain_seed'] = terrain_seed
+            header['has_terrain'] = 1
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(header.tobytes())
+            f.write(np.asarray(genome_keys, dtype='<i8').tobytes())
+
+        trajectory = TrajectoryFile.open(path, mode='r+')
+        trajectory.poses[:] = np.nan
+        return trajectory
+
+    @staticmethod
+    def open(path, mode='r'):
+        header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)[0]
+        if header['magic'] != MAGIC:
+            raise ValueError(f"{path} is not a trajectory file")
+        walkers = int(header['walkers'])
+        genome_keys = np.fromfile(path, dtype='<i8', count=walkers, offset=HEADER_DTYPE.itemsize)
+        shape = (int(header['steps']) + 1, walkers, int(header['bodies']), int(header['fields']))
+        offset = HEADER_DTYPE.itemsize + 8 * walkers
+        # r+ grows a freshly created file to its full size (w+ would wipe the header)
+        poses = np.memmap(path, dtype='<f4', mode=mode, offset=offset, shape=shape)
+        return TrajectoryFile(path, header, genome_keys, poses)
+
+    @property
+    def dt(self):
+        return float(self.header['dt'])
+
+    @property
+    def generation(self):
+        return int(self.header['generation'])
+
+    @property
+    def terrain_seed(self):
+        return int(self.header['terrain_seed']) if self.header['has_terrain'] else None
+
+    def terrain(self):
+        """The terrain.Terrain the walkers walked on."""
+        return FLAT if self.terrain_seed is None else generate(self.terrain_seed)
+
+    def recorder(self, genome_keys):
+        """Recorder for a simulate() call whose rows are the walkers with these genome keys."""
+        slot_of = {int(key): slot for slot, key in enumerate(self.genome_keys)}
+        slots = np.array([slot_of.get(int(key), -1) for key in genome_keys], dtype=np.intp)
+        return TrajectoryRecorder(self, slots)
+
+    def recorded_steps(self):
+        """Number of steps until the last walker disappeared."""
+        alive = ~np.isnan(self.poses[:, :, 0, 0]).all(axis=1)
+        return int(np.flatnonzero(alive)[-1]) + 1 if alive.any() else 0
+
+    def flush(self):
+        self.poses.flush()
+
+
+class TrajectoryRecorder:
+    def __init__(self, trajectory, slots):
+        self.trajectory = trajectory
+        self.slots = slots
+
+    def record(self, step, state, rows):
+        if step >= len(self.trajectory.poses):
+            return
+        slots = self.slots[rows]
+        keep = slots >= 0
+        self.trajectory.poses[step, slots[keep]] = state.data[rows[keep], :, :3]
+
+    def close(self):
+        self.trajectory.flush()
+
+
+def draw_poses(surface, poses, camera_x, ground_y=GROUND_Y, terrain=None):
+    """
+    Draw one step of a trajectory (walkers, bodies, [x, y, angle]) onto a
+    pygame surface, on the flat ground at ground_y or on a terrain.Terrain.
+    """
+    import pygame
+
+    surface.fill((135, 206, 235))
+    if terrain is None or len(terrain) == 1:
+        pygame.draw.line(surface, (0, 0, 0), (0, ground_y), (surface.get_width(), ground_y), 8)
+    else:
+        # only the points on screen plus one on either side
+        first = max(0, int(np.searchsorted(terrain.xs, camera_x)) - 1)
+        last = int(np.searchsorted(terrain.xs, camera_x + surface.get_width())) + 1
+        visible = terrain.points[first:last + 1] - (camera_x, 0)
+        pygame.draw.lines(surface, (0, 0, 0), False, visible.tolist(), 8)
+    for walker in poses:
+        if np.isnan(walker[0, 0]):
+            continue
+        for name, (x, y, angle) in zip(BODY_NAMES, walker.tolist()):
+            size, color = BODY_SHAPES[name]
+            center = (x - camera_x, y)
+            if isinstance(size, tuple):
+                w, h = size[0] / 2, size[1] / 2
+                cos_a, sin_a = math.cos(angle), math.sin(angle)
+                corners = [(center[0] + px * cos_a - py * sin_a, center[1] + px * sin_a + py * cos_a)
+                           for px, py in ((-w, -h), (w, -h), (w, h), (-w, h))]
+                pygame.draw.polygon(surface, color, corners)
+            else:
+                pygame.draw.circle(surface, color, center, size)
+
+
+def frames(trajectory, every, width):
+    """Yield (step, poses, camera_x) for every `every`-th recorded step, the camera follows the leader."""
+    for step in range(0, trajectory.recorded_steps(), every):
+        poses = np.asarray(trajectory.poses[step])
+        torso_x = poses[:, 0, 0]
+        camera_x = 0.0
+        if not np.isnan(torso_x).all():
+            camera_x = max(0.0, float(np.nanmax(torso_x)) - width / 3)
+        yield step, poses, camera_x
+
+
+def view(path, speed=1, fps=60, width=1500, height=1000):
+    import pygame
+
+    trajectory = TrajectoryFile.open(path)
+    terrain = trajectory.terrain()
+    pygame.init()
+    screen = pygame.display.set_mode((width, height))
+    pygame.display.set_caption(f"Trajectory {os.path.basename(path)} (generation {trajectory.generation})")
+    clock = pygame.time.Clock()
+    for step, poses, camera_x in frames(trajectory, speed, width):
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                return
+        draw_poses(screen, poses, camera_x, terrain=terrain)
+        pygame.display.flip()
+        clock.tick(fps)
+    pygame.quit()
+
+
+def export_gif(path, output, every=2, width=750, height=500, scale=0.5):
+    import pygame
+    from PIL import Image
+
+    trajectory = TrajectoryFile.open(path)
+    terrain = trajectory.terrain()
+    full = pygame.Surface((int(width / scale), int(height / scale)))
+    images = []
+    for step, poses, camera_x in frames(trajectory, every, full.get_width()):
+        draw_poses(full, poses, camera_x, terrain=terrain)
+        small = pygame.transform.smoothscale(full, (width, height))
+        images.append(Image.frombytes('RGB', (width, height), pygame.image.tobytes(small, 'RGB')))
+    if not images:
+        raise ValueError(f"{path} has no recorded steps")
+    duration = int(round(1000 * trajectory.dt * every))
+    images[0].save(output, save_all=True, append_images=images[1:], duration=duration, loop=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='View or export recorded walker trajectories')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    view_parser = subparsers.add_parser('view', help='Play a trajectory in a window')
+    view_parser.add_argument('path')
+    view_parser.add_argument('--speed', type=int, default=1, help='Physics steps per frame')
+    view_parser.add_argument('--fps', type=int, default=60)
+    gif_parser = subparsers.add_parser('gif', help='Export a trajectory as an animated GIF')
+    gif_parser.add_argument('path')
+    gif_parser.add_argument('output')
+    gif_parser.add_argument('--every', type=int, default=2, help='Use every Nth physics step as a frame')
+    args = parser.parse_args()
+
+    if args.command == 'view':
+        view(args.path, speed=args.speed, fps=args.fps)
+    else:
+        export_gif(args.path, args.output, every=args.every)
+
+
+if __name__ == '__main__':
+    main()